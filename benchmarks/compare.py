@@ -0,0 +1,58 @@
+"""
+2つのベンチマーク結果(benchmarks.runの出力)のステージごとの中央値を比較する
+
+使い方: python -m benchmarks.compare benchmarks/results/<変更前>.json benchmarks/results/<変更後>.json
+"""
+import json
+import argparse
+
+from .run import STAGES
+
+
+def load(path: str) -> dict:
+    """
+    ベンチマーク結果を読み込む
+
+    @param path: ファイルパス
+    @return: ベンチマーク結果
+    """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(base: dict, new: dict) -> list:
+    """
+    ステージごとの中央値と変化率を返す
+
+    @param base: 変更前のベンチマーク結果
+    @param new: 変更後のベンチマーク結果
+    @return: [(ステージ名, 変更前(ms), 変更後(ms), 変化率(%)), ...] (計測できなかったステージはNone)
+    """
+    rows = list()
+    for stage in STAGES:
+        before = base['stages'].get(stage, dict()).get('median_ms')
+        after = new['stages'].get(stage, dict()).get('median_ms')
+        change = (after - before) / before * 100 if before and after is not None else None
+        rows.append((stage, before, after, change))
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク結果の比較')
+    parser.add_argument('base', help='変更前の結果')
+    parser.add_argument('new', help='変更後の結果')
+    args = parser.parse_args()
+
+    base, new = load(args.base), load(args.new)
+    print(f"{'stage':<14}{base['commit']:>14}{new['commit']:>14}{'change':>10}")
+
+    def fmt(value, spec: str, width: int) -> str:
+        return format(format(value, spec) if value is not None else '-', f'>{width}')
+
+    for stage, before, after, change in compare(base, new):
+        print(f"{stage:<14}{fmt(before, '.2f', 12)}ms{fmt(after, '.2f', 12)}ms{fmt(change, '+.1f', 9)}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+ベンチマーク用のぐるなびAPIの偽サーバ
+fixtures/rest_search.jsonの店舗を雛形に、格子状に配置した架空の店舗から検索範囲内のものを返す
+(隣り合う駅の検索結果は実際と同じように重なる)
+遅延・エラー(500, 404)の発生率・店舗の密度を指定できる
+
+単体で起動する場合: python -m benchmarks.fake_gurunavi --port 8001 --latency 0.08
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+import threading
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from typing import Optional, Tuple
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'rest_search.json')
+RANGE_METERS = {1: 300, 2: 500, 3: 1000, 4: 2000, 5: 3000}  # ぐるなびAPIの検索範囲 → 半径(m)
+METERS_PER_DEGREE = 111320  # 緯度1度あたりの距離(m)
+GRID_LAT = 35.0  # 経度方向の格子間隔を求める基準緯度
+NO_IMAGE_RATE = 0.2  # 店舗ページに画像が無い店舗の割合
+
+
+class FakeGurunavi:
+    """
+    偽ぐるなびAPIクラス
+    """
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_500: float = 0.0, error_404: float = 0.0,
+                 density: float = 0.3, cell: float = 100, seed: int = 0, fixture: str = FIXTURE):
+        """
+        初期化メソッド
+
+        @param latency: レスポンスまでの遅延(秒)
+        @param jitter: 遅延に加える揺らぎの最大値(秒)
+        @param error_500: 500を返す割合
+        @param error_404: 404を返す割合
+        @param density: 1格子あたりに店舗がある確率(検索結果の件数の調整用)
+        @param cell: 格子の間隔(m)
+        @param seed: エラー・遅延の乱数のシード
+        @param fixture: 雛形にする検索結果のJSONファイル
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_500 = error_500
+        self.error_404 = error_404
+        self.density = density
+        self.dlat = cell / METERS_PER_DEGREE
+        self.dlng = cell / (METERS_PER_DEGREE * math.cos(math.radians(GRID_LAT)))
+        with open(fixture, encoding='utf-8') as f:
+            self.templates = json.load(f)['rest']
+        self.base_url = ''
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {'search': 0, 'shop': 0, '500': 0, '404': 0}
+
+    def _count(self, key: str) -> None:
+        """
+        リクエスト数を加算する
+
+        @param key: カウンタ名
+        """
+        with self._lock:
+            self.counts[key] += 1
+
+    def _roll(self) -> Tuple[float, float]:
+        """
+        遅延とエラー判定用の乱数を返す
+
+        @return: (遅延(秒), 0〜1の乱数)
+        """
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter), self._random.random()
+
+    @staticmethod
+    def _hash(*keys) -> float:
+        """
+        キーから0〜1の決定的な値を返す
+
+        @return: 0〜1の値
+        """
+        return zlib.crc32(':'.join(map(str, keys)).encode('utf-8')) / 2 ** 32
+
+    def _shops(self, lat: float, lng: float, radius: float) -> list:
+        """
+        検索範囲内の架空の店舗を近い順に返す
+
+        @param lat: 検索地点の緯度
+        @param lng: 検索地点の経度
+        @param radius: 検索範囲の半径(m)
+        @return: 店舗のリスト
+        """
+        shops = list()
+        ri = int(radius / METERS_PER_DEGREE / self.dlat) + 1
+        rj = int(radius / (METERS_PER_DEGREE * math.cos(math.radians(lat))) / self.dlng) + 1
+        ci, cj = int(lat / self.dlat), int(lng / self.dlng)
+        for i in range(ci - ri, ci + ri + 1):
+            for j in range(cj - rj, cj + rj + 1):
+                if self._hash(i, j) >= self.density:
+                    continue
+                shop_lat = (i + self._hash(i, j, 'lat')) * self.dlat
+                shop_lng = (j + self._hash(i, j, 'lng')) * self.dlng
+                dy = (shop_lat - lat) * METERS_PER_DEGREE
+                dx = (shop_lng - lng) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+                dist = math.hypot(dx, dy)
+                if dist <= radius:
+                    shops.append((dist, i, j, shop_lat, shop_lng))
+        shops.sort()
+
+        return shops
+
+    def _render_shop(self, i: int, j: int, lat: float, lng: float) -> dict:
+        """
+        雛形から架空の店舗のレコードを作成する
+
+        @return: 店舗のレコード
+        """
+        template = self.templates[zlib.crc32(f'{i}:{j}'.encode('utf-8')) % len(self.templates)]
+        shop = deepcopy(template)
+        shop_id = f'f{i}_{j}'
+        shop['id'] = shop_id
+        shop['name'] = f"{template['name']} {shop_id}"
+        shop['latitude'] = f'{lat:.6f}'
+        shop['longitude'] = f'{lng:.6f}'
+        shop['url'] = f'{self.base_url}/shop/{shop_id}/'
+
+        return shop
+
+    def search(self, query: dict) -> Tuple[int, dict]:
+        """
+        検索APIのレスポンスを返す
+
+        @param query: クエリパラメータ(値は1個)
+        @return: (ステータスコード, JSON)
+        """
+        self._count('search')
+        latency, roll = self._roll()
+        time.sleep(latency)
+        if roll < self.error_500:
+            self._count('500')
+            return 500, {'error': [{'code': 500, 'message': 'Internal Server Error'}]}
+
+        shops = self._shops(float(query['latitude']), float(query['longitude']),
+                            RANGE_METERS[int(query.get('range', 2))])
+        if roll < self.error_500 + self.error_404 or len(shops) == 0:
+            self._count('404')
+            return 404, {'error': [{'code': 404, 'message': '指定された店舗の情報が存在しません'}]}
+
+        hit_per_page = int(query.get('hit_per_page', 10))
+        page = int(query.get('offset_page', 1))
+        page_shops = shops[(page - 1) * hit_per_page: page * hit_per_page]
+        rest = [self._render_shop(i, j, lat, lng) for _, i, j, lat, lng in page_shops]
+
+        return 200, {'@attributes': {'api_version': 'v3'}, 'total_hit_count': len(shops),
+                     'hit_per_page': hit_per_page, 'page_offset': page, 'rest': rest}
+
+    def shop_page(self, shop_id: str) -> Tuple[int, str]:
+        """
+        店舗ページのhtmlを返す
+
+        @param shop_id: 店舗ID
+        @return: (ステータスコード, html)
+        """
+        self._count('shop')
+        latency, _ = self._roll()
+        time.sleep(latency)
+        if self._hash(shop_id, 'img') < NO_IMAGE_RATE:
+            return 200, '<html><body><div id="main"></div></body></html>'
+
+        return 200, (f'<html><body><div id="motif-slider-main">'
+                     f'<img src="//c-r.gnst.jp/img/{shop_id}.jpg"></div></body></html>')
+
+
+class FakeGurunaviServer:
+    """
+    偽ぐるなびAPIを別スレッドで起動するHTTPサーバ
+    """
+    def __init__(self, api: Optional[FakeGurunavi] = None, host: str = '127.0.0.1', port: int = 0):
+        """
+        初期化メソッド
+
+        @param api: 偽ぐるなびAPI
+        @param host: ホスト
+        @param port: ポート(0の場合は空いているポート)
+        """
+        self.api = api or FakeGurunavi()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self.api))
+        self.httpd.daemon_threads = True
+        self.api.base_url = self.url
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        サーバのurl e.g.) 'http://127.0.0.1:8001'
+        """
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def api_base(self) -> str:
+        """
+        GURUNAVI_API_BASEに指定するurl
+        """
+        return self.url + '/RestSearchAPI/v3/'
+
+    def start(self) -> 'FakeGurunaviServer':
+        """
+        サーバを起動する
+
+        @return: self
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        サーバを停止する
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'FakeGurunaviServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _make_handler(api: FakeGurunavi) -> type:
+    """
+    偽ぐるなびAPIに振り分けるリクエストハンドラを作成する
+
+    @param api: 偽ぐるなびAPI
+    @return: リクエストハンドラのクラス
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-aliveを有効にする
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            shop = re.match(r'^/shop/([^/]+)/?$', url.path)
+            if url.path.startswith('/RestSearchAPI/'):
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, body = api.search(query)
+                self._send(status, json.dumps(body, ensure_ascii=False), 'application/json; charset=utf-8')
+            elif shop:
+                status, body = api.shop_page(shop.group(1))
+                self._send(status, body, 'text/html; charset=utf-8')
+            else:
+                self._send(404, 'Not Found', 'text/plain; charset=utf-8')
+
+        def _send(self, status: int, body: str, content_type: str) -> None:
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用のぐるなびAPIの偽サーバ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.05, help='レスポンスまでの遅延(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='遅延の揺らぎの最大値(秒)')
+    parser.add_argument('--error-500', type=float, default=0.0, help='500を返す割合')
+    parser.add_argument('--error-404', type=float, default=0.0, help='404を返す割合')
+    parser.add_argument('--density', type=float, default=0.3, help='100m四方あたりに店舗がある確率')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeGurunavi(args.latency, args.jitter, args.error_500, args.error_404, args.density, seed=args.seed)
+    server = FakeGurunaviServer(api, args.host, args.port)
+    print(f'GURUNAVI_API_BASE={server.api_base}')
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
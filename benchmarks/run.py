@@ -0,0 +1,261 @@
+"""
+検索処理のステージごとの処理時間を計測するベンチマーク
+ぐるなびAPI・店舗ページは偽サーバ(fake_gurunavi.py)、駅情報は架空の路線データを用いる(--dbでstation_infoを使用)
+
+使い方(リポジトリ直下で実行): python -m benchmarks.run --repeat 5 --latency 0.05
+結果は benchmarks/results/<日時>-<コミット>.json に保存し、benchmarks.compareで比較する
+"""
+import os
+import json
+import math
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+import pandas as pd
+
+from .fake_gurunavi import FakeGurunavi, FakeGurunaviServer
+
+from typing import Callable, Optional
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+STAGES = ['station_load', 'validation', 'fuzzy', 'section', 'fanout', 'merge', 'images', 'render']
+
+
+def make_station_df(n_lines: int = 50, n_stations: int = 30) -> pd.DataFrame:
+    """
+    架空の路線データ(station_infoと同じ列)を作成する
+    路線0は環状線、それ以外は東京付近を放射状に延びる約1km間隔の路線
+    (駅名は入力の「駅」を取り除く処理と衝突しないよう'1線0番'の形式にする)
+
+    @param n_lines: 路線数
+    @param n_stations: 路線あたりの駅数
+    @return: 駅情報のデータフレーム
+    """
+    rows = list()
+    for line in range(n_lines):
+        for station in range(n_stations):
+            if line == 0:
+                angle = 2 * math.pi * station / n_stations
+                radius = n_stations / (2 * math.pi) / 111.32  # 駅間約1km
+                lat, lon = 35.68 + radius * math.sin(angle), 139.76 + radius * math.cos(angle) * 1.22
+            else:
+                angle = 2 * math.pi * line / n_lines
+                lat = 35.68 + station / 111.32 * math.sin(angle)
+                lon = 139.76 + station / 111.32 * math.cos(angle) * 1.22
+            rows.append((len(rows), 1000 + line, 100000 + len(rows), f'路線{line}', f'rosen{line}',
+                         f'{line}線{station}番', f'{line}sen{station}ban', lat, lon))
+
+    return pd.DataFrame(rows, columns=['index', 'line_cd', 'station_cd', 'line_name', 'line_name_roman',
+                                       'station_name', 'station_name_roman', 'lat', 'lon'])
+
+
+def measure(func: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> dict:
+    """
+    funcをrepeat回実行して処理時間の統計を返す(setupは計測に含めない)
+
+    @param func: 計測する処理
+    @param repeat: 実行回数
+    @param setup: 毎回の実行前に行う処理(キャッシュの削除等)
+    @return: e.g.) {'runs': 5, 'min_ms': 1.2, 'median_ms': 1.3, 'mean_ms': 1.3, 'p95_ms': 1.5, 'max_ms': 1.5}
+        (例外が発生した場合は{'error': 例外のメッセージ})
+    """
+    times = list()
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+    except Exception as ex:
+        return {'error': f'{type(ex).__name__}: {ex}'}
+
+    times.sort()
+    return {
+        'runs': len(times),
+        'min_ms': round(times[0], 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+        'p95_ms': round(times[min(len(times) - 1, math.ceil(len(times) * 0.95) - 1)], 3),
+        'max_ms': round(times[-1], 3),
+    }
+
+
+def git_commit() -> str:
+    """
+    現在のコミット(未コミットの変更がある場合は'-dirty'付き)を返す
+
+    @return: e.g.) '6207d42'
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return commit + ('-dirty' if dirty else '')
+
+
+def setup_django(api_base: str) -> None:
+    """
+    偽サーバを向くように環境変数を設定してDjangoを初期化する
+    (アプリのモジュールは定数を読み込み時に確定するため、この後にimportする)
+
+    @param api_base: 偽サーバのurl
+    """
+    os.environ['GURUNAVI_API_BASE'] = api_base
+    # 本番のキャッシュを消さないよう、ベンチマークではローカルメモリを用いる
+    os.environ['GURUNAVI_CACHE_BACKEND'] = 'django.core.cache.backends.locmem.LocMemCache'
+    os.environ['SNAPSHOT_CACHE_BACKEND'] = 'django.core.cache.backends.locmem.LocMemCache'
+    os.environ['SHOP_IMAGE_CACHE_BACKEND'] = 'django.core.cache.backends.locmem.LocMemCache'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stopover_food_project.settings')
+
+    import django
+    django.setup()
+
+
+def run(args: argparse.Namespace, server: FakeGurunaviServer) -> dict:
+    """
+    各ステージを計測する
+
+    @param args: コマンドライン引数
+    @param server: 起動済みの偽サーバ
+    @return: ステージ名 → 処理時間の統計
+    """
+    from django.core.cache import caches
+    from django.template import loader
+    from django.test import RequestFactory
+    from stopover_food_app import station_index, shop_cache, ratelimit, guruanvi
+    from stopover_food_app.consts import PAGE_NUM, SCRAPE_RATE, SCRAPE_BURST
+    from stopover_food_app.stopover_food import StopoverFood
+
+    results = dict()
+    if args.db:
+        load = station_index.StationIndex.from_db
+    else:
+        df = make_station_df(args.lines, args.stations)
+        load = lambda: station_index.StationIndex(df)  # noqa: E731
+    results['station_load'] = measure(load, args.repeat)
+    station_index._station_index = load()
+
+    query = (args.line, args.start, args.end, 'ra-men')
+    sf = StopoverFood(*query, range_=args.range)
+    results['validation'] = measure(lambda: sf._validation(), args.repeat)
+
+    # 入力ミスの「もしかして」候補(索引の作成は初回のみのため計測に含めない)
+    typo = StopoverFood(args.typo_line, args.start, args.end, 'ra-men', range_=args.range)
+    typo._get_station_index()
+    typo.station_index.fuzzy_index
+    results['fuzzy'] = measure(lambda: typo._validation(), args.repeat)
+
+    sf._validation()
+    results['section'] = measure(sf._get_section_stations, args.repeat)
+    stations = sf._get_section_stations()
+
+    def clear_shop_cache():
+        caches['gurunavi'].clear()
+        shop_cache._shop_cache = None
+
+    food_list = list()
+    results['fanout'] = measure(lambda: food_list.append(sf._exec_gurunavi_api(stations)), args.repeat,
+                                clear_shop_cache)
+    food_list = food_list[-1] if food_list else list()
+
+    data = list()
+    results['merge'] = measure(lambda: data.append(sf._merge_foods(food_list, stations)), args.repeat)
+    data = data[-1][:PAGE_NUM] if data else list()
+
+    def reset_images():
+        caches['shop_image'].clear()
+        ratelimit._rate_limiter = ratelimit.HostRateLimiter(args.scrape_rate or SCRAPE_RATE, SCRAPE_BURST)
+        for food in data:
+            food['img'] = ''
+
+    results['images'] = measure(lambda: guruanvi.get_img(data), args.repeat, reset_images)
+
+    template = loader.get_template('stopover_food_app/index.html')
+    request = RequestFactory().get('/', dict(zip(['line', 'start', 'end', 'category'], query)))
+    context = {'data': data, 'pagecount': 3, 'pagecount_estimated': False, 'message': '', 'snapshot': ''}
+    results['render'] = measure(lambda: template.render(context, request), args.repeat)
+
+    results['_counts'] = {'stations': len(stations), 'rows': len(food_list), 'shops': len(data),
+                          'server': dict(server.api.counts)}
+
+    return results
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    """
+    コマンドライン引数を解析する
+
+    @param argv: コマンドライン引数
+    @return: 解析結果
+    """
+    parser = argparse.ArgumentParser(description='検索処理のステージごとのベンチマーク')
+    parser.add_argument('--repeat', type=int, default=5, help='ステージごとの実行回数')
+    parser.add_argument('--latency', type=float, default=0.05, help='偽サーバの遅延(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='偽サーバの遅延の揺らぎ(秒)')
+    parser.add_argument('--error-500', type=float, default=0.0, help='偽サーバが500を返す割合')
+    parser.add_argument('--error-404', type=float, default=0.0, help='偽サーバが404を返す割合')
+    parser.add_argument('--density', type=float, default=0.3, help='100m四方あたりに店舗がある確率')
+    parser.add_argument('--scrape-rate', type=float, default=None, help='画像取得のレート(default: SCRAPE_RATE)')
+    parser.add_argument('--db', action='store_true', help='架空の路線データの代わりにstation_infoを用いる')
+    parser.add_argument('--lines', type=int, default=50, help='架空の路線数')
+    parser.add_argument('--stations', type=int, default=30, help='架空の路線あたりの駅数')
+    parser.add_argument('--range', type=int, default=3, help='検索範囲')
+    parser.add_argument('--line', default='路線1')
+    parser.add_argument('--start', default='1線0番')
+    parser.add_argument('--end', default='1線14番')
+    parser.add_argument('--typo-line', default='ろせん', help='「もしかして」候補の計測に用いる路線名')
+    parser.add_argument('--output', default=None, help='結果の出力先(default: benchmarks/results/<日時>-<コミット>.json)')
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list] = None) -> str:
+    """
+    偽サーバを起動してベンチマークを実行し、結果をJSONファイルに保存する
+
+    @param argv: コマンドライン引数
+    @return: 結果のファイルパス
+    """
+    args = parse_args(argv)
+    api = FakeGurunavi(args.latency, args.jitter, args.error_500, args.error_404, args.density)
+    with FakeGurunaviServer(api) as server:
+        setup_django(server.api_base)
+        results = run(args, server)
+
+    commit = git_commit()
+    now = datetime.datetime.now()
+    report = {
+        'commit': commit,
+        'datetime': now.isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'counts': results.pop('_counts'),
+        'stages': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{now.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for stage in STAGES:
+        stats = results[stage]
+        if 'error' in stats:
+            print(f"{stage:<14}{stats['error'].strip().splitlines()[0]}")
+        else:
+            print(f"{stage:<14}{stats['median_ms']:>10.2f} ms (median)")
+    print(f'saved: {output}')
+
+    return output
+
+
+if __name__ == '__main__':
+    main()
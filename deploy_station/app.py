@@ -2,6 +2,8 @@
 駅データ.jpから駅データと路線データをダウンロード→結合→ファイル出力するスクリプト
 とりあえず手動定期実行
 """
+from io import StringIO
+from argparse import ArgumentParser
 from time import sleep
 from tempfile import NamedTemporaryFile
 
@@ -9,11 +11,12 @@ import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import psycopg2
+from psycopg2.extras import execute_values
 
-from functions import RomanaizeST
+from functions import romanaize_batch
 from consts import WAIT_TIME, CSV_STATION, HEADERS, BASE_URL, DL_PAGE_URL, DL_URL, LOGIN_INFO, DATABASE
 
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 
 def login(url: str) -> requests.sessions.Session:
@@ -125,31 +128,46 @@ def validation_station(df: pd.DataFrame) -> None:
         raise RuntimeError("路線データが空です")
 
 
-def preprocess_line(df: pd.DataFrame) -> pd.DataFrame:
+def romanaize_column(names: pd.Series, known_romans: Optional[Dict[str, str]] = None) -> pd.Series:
+    """
+    名称の列をローマ字の列に変換する
+    重複を除いてまとめてローマ字変換し、名称 → ローマ字の対応で列を作成する
+
+    @param names: 名称の列
+    @param known_romans: 変換済みの名称 → ローマ字(含まれる名称は変換しない)
+    @return: ローマ字の列
+    """
+    romans = dict(known_romans or dict())
+    romans.update(romanaize_batch([name for name in pd.unique(names) if name not in romans]))
+
+    return names.map(romans)
+
+
+def preprocess_line(df: pd.DataFrame, known_romans: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """
     路線データのデータフレームに対する前処理関数
     前処理済みデータフレームを返す
 
     @param df: 路線データのデータフレーム
+    @param known_romans: 変換済みの路線名 → ローマ字(含まれる路線名はローマ字変換しない)
     @return: 前処理済みデータフレーム
     """
     line_cd, line_name, line_name_roman = 'line_cd', 'line_name', 'line_name_roman'
     # 路線名の()内の文字列を削除する  e.g.) 'JR函館本線(函館～長万部)' → 'JR函館本線'
     df[line_name] = df[line_name].str.replace(r'\(.+?\)', '', regex=True)
 
-    line_names = df[line_name].to_list()
-    rs = RomanaizeST()
-    df[line_name_roman] = [rs.romanaize(line)[0].replace("'", "") for line in line_names]
+    df[line_name_roman] = romanaize_column(df[line_name], known_romans)
 
     return df[[line_cd, line_name, line_name_roman]]
 
 
-def preprocess_station(df: pd.DataFrame) -> pd.DataFrame:
+def preprocess_station(df: pd.DataFrame, known_romans: Optional[Dict[str, str]] = None) -> pd.DataFrame:
     """
     駅データのデータフレームに対する前処理関数
     前処理済みデータフレームを返す
 
     @param df: 駅データのデータフレーム
+    @param known_romans: 変換済みの駅名 → ローマ字(含まれる駅名はローマ字変換しない)
     @return: 前処理済みデータフレーム
     """
     roman = 'station_name_roman'
@@ -158,9 +176,8 @@ def preprocess_station(df: pd.DataFrame) -> pd.DataFrame:
     # 閉駅済みの駅を削除
     df = df[df.close_ymd == '0000-00-00']
 
-    station_names = df['station_name'].to_list()
-    rs = RomanaizeST()
-    df[roman] = [rs.romanaize(station)[0].replace("'", "") for station in station_names]
+    # 駅名は路線をまたいで重複が多いため、重複を除いてまとめてローマ字変換する
+    df[roman] = romanaize_column(df['station_name'], known_romans)
 
     return df[headers]
 
@@ -168,39 +185,134 @@ def preprocess_station(df: pd.DataFrame) -> pd.DataFrame:
 def create_table(df: pd.DataFrame) -> None:
     """
     前処理済みのデータフレームを元にテーブルを作成する
+    ステージングテーブルにCOPYで一括投入・インデックス作成後、1トランザクションで本番テーブルと入れ替える
+    (入れ替えまでは旧テーブルがそのまま参照できる)
 
     @param df: 前処理済みのデータフレーム
     """
     table_name = 'station_info'
-
+    staging_name = f'{table_name}_staging'
+    create_sql = """
+        CREATE TABLE {} (
+            index INTEGER,
+            line_cd  INTEGER,
+            station_cd  INTEGER,
+            line_name  VARCHAR (250),
+            line_name_roman VARCHAR (250),
+            station_name VARCHAR (250),
+            station_name_roman VARCHAR (250),
+            lat NUMERIC,
+            lon NUMERIC
+        );
+        """
+    # アプリが参照するインデックス {インデックス名の接尾辞: カラム}
+    indexes = {'line_name_idx': 'line_name', 'line_name_station_name_idx': 'line_name, station_name'}
+
+    # データフレームのindexをindexカラムとしてCSV形式で書き出す
+    buf = StringIO()
+    df.to_csv(buf, header=False, index=True)
+    buf.seek(0)
+
+    # ステージングテーブルの作成
     with psycopg2.connect(**DATABASE) as conn:
         cur = conn.cursor()
-        drop_sql = "DROP TABLE IF EXISTS {};"
-        create_sql = """
-            CREATE TABLE {} (
-                index INTEGER,
-                line_cd  INTEGER,
-                station_cd  INTEGER,
-                line_name  VARCHAR (250),
-                line_name_roman VARCHAR (250),
-                station_name VARCHAR (250),
-                station_name_roman VARCHAR (250),
-                lat NUMERIC,
-                lon NUMERIC
-            );
-            """
-        cur.execute(drop_sql.format(table_name))
-        cur.execute(create_sql.format(table_name))
+        cur.execute(f"DROP TABLE IF EXISTS {staging_name};")
+        cur.execute(create_sql.format(staging_name))
+        cur.copy_expert(f"COPY {staging_name} FROM STDIN WITH (FORMAT csv)", buf)
+        for suffix, columns in indexes.items():
+            cur.execute(f"CREATE INDEX {staging_name}_{suffix} ON {staging_name} ({columns});")
+        cur.execute(f"ANALYZE {staging_name};")
+
+    # 本番テーブルとの入れ替え
     with psycopg2.connect(**DATABASE) as conn:
         cur = conn.cursor()
-        sql = "INSERT INTO {} VALUES {}"
-        for line in df.itertuples():
-            cur.execute(sql.format(table_name, tuple(line)))
+        cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+        cur.execute(f"ALTER TABLE {staging_name} RENAME TO {table_name};")
+        for suffix in indexes:
+            cur.execute(f"ALTER INDEX {staging_name}_{suffix} RENAME TO {table_name}_{suffix};")
+
+
+def read_station_info() -> pd.DataFrame:
+    """
+    現在のstation_infoテーブルをデータフレームとして読み込む
+
+    @return: station_infoのデータフレーム
+    """
+    with psycopg2.connect(**DATABASE) as conn:
+        df = pd.read_sql("select * from station_info;", conn)
+    df[['lat', 'lon']] = df[['lat', 'lon']].astype(float)
+
+    return df
+
 
+def diff_station_info(current: pd.DataFrame, new: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, list]:
+    """
+    現在のstation_infoと新しい駅データをstation_cdをキーに比較する
+
+    @param current: 現在のstation_infoのデータフレーム
+    @param new: 新しい駅データのデータフレーム(indexカラム付き)
+    @return: (追加する行, 内容を更新する行, 駅順(indexカラム)のみ更新する行, 削除するstation_cdのリスト)
+    """
+    key = 'station_cd'
+    columns = [header for header in HEADERS if header != key]
+
+    inserts = new[~new[key].isin(current[key])]
+    deletes = current.loc[~current[key].isin(new[key]), key].to_list()
 
-def main():
+    both = pd.merge(new, current, on=key, suffixes=('', '_current'))
+    changed = pd.Series(False, index=both.index)
+    for column in columns:
+        if column in ('lat', 'lon'):
+            changed |= (both[column] - both[f'{column}_current']).abs() > 1e-9
+        else:
+            changed |= both[column] != both[f'{column}_current']
+    # 駅の追加・削除で後続の駅のindexがずれた行
+    reordered = ~changed & (both['index'] != both['index_current'])
+    updates = both.loc[changed, new.columns]
+    reorders = both.loc[reordered, new.columns]
+
+    return inserts, updates, reorders, deletes
+
+
+def apply_station_diff(inserts: pd.DataFrame, updates: pd.DataFrame, deletes: list) -> None:
+    """
+    差分(追加・更新・削除)を1トランザクションでstation_infoに反映する
+
+    @param inserts: 追加する行
+    @param updates: 更新する行
+    @param deletes: 削除するstation_cdのリスト
+    """
+    columns = ['index'] + HEADERS
+    set_columns = [column for column in columns if column != 'station_cd']
+    set_sql = ", ".join(
+        f"{column} = v.{column}::numeric" if column in ('lat', 'lon') else f"{column} = v.{column}"
+        for column in set_columns
+    )
+
+    with psycopg2.connect(**DATABASE) as conn:
+        cur = conn.cursor()
+        if deletes:
+            cur.execute("DELETE FROM station_info WHERE station_cd = ANY(%s);", (deletes,))
+        if not updates.empty:
+            execute_values(
+                cur,
+                f"UPDATE station_info AS t SET {set_sql} FROM (VALUES %s) AS v ({', '.join(columns)}) "
+                "WHERE t.station_cd = v.station_cd;",
+                updates[columns].values.tolist()
+            )
+        if not inserts.empty:
+            execute_values(
+                cur,
+                f"INSERT INTO station_info ({', '.join(columns)}) VALUES %s;",
+                inserts[columns].values.tolist()
+            )
+
+
+def main(incremental: bool = False):
     """
     メインスクリプト
+
+    @param incremental: Trueのとき現在のstation_infoとの差分のみ反映する(新規・名称変更分のみローマ字変換する)
     """
     session = login(DL_PAGE_URL)
     soup = get_soup(DL_PAGE_URL, session)
@@ -221,19 +333,42 @@ def main():
     validation_line(line_df)
     validation_station(station_df)
 
+    # 差分更新の場合は現在のテーブルのローマ字を使い回す
+    current = read_station_info() if incremental else None
+    known_line_romans, known_station_romans = None, None
+    if current is not None:
+        known_line_romans = dict(zip(current['line_name'], current['line_name_roman']))
+        known_station_romans = dict(zip(current['station_name'], current['station_name_roman']))
+
     # 前処理
-    line_df = preprocess_line(line_df)
-    station_df = preprocess_station(station_df)
+    line_df = preprocess_line(line_df, known_line_romans)
+    station_df = preprocess_station(station_df, known_station_romans)
 
     # line_cdをキーに結合
     line_station = pd.merge(station_df, line_df, on='line_cd')
 
-    # テーブル作成
-    create_table(line_station[HEADERS])
+    if current is None:
+        # テーブル作成
+        create_table(line_station[HEADERS])
+    else:
+        # 差分のみ反映
+        new = line_station[HEADERS].rename_axis('index').reset_index()
+        inserts, updates, reorders, deletes = diff_station_info(current, new)
+        apply_station_diff(inserts, pd.concat([updates, reorders]), deletes)
+        print(f"追加: {len(inserts)}件, 更新: {len(updates)}件, 削除: {len(deletes)}件, 駅順のみ更新: {len(reorders)}件")
+        for station in inserts.itertuples():
+            print(f"  追加: {station.line_name} {station.station_name}")
+        for station in updates.itertuples():
+            print(f"  更新: {station.line_name} {station.station_name}")
+        for station in current[current['station_cd'].isin(deletes)].itertuples():
+            print(f"  削除: {station.line_name} {station.station_name}")
 
     # csvファイルとして出力
     # line_station[HEADERS].to_csv(CSV_STATION, encoding='cp932', index=False)
 
 
 if __name__ == '__main__':
-    main()
+    parser = ArgumentParser(description='駅データ.jpの駅データ・路線データでstation_infoテーブルを更新する')
+    parser.add_argument('--incremental', action='store_true', help='現在のテーブルとの差分のみ反映する')
+    args = parser.parse_args()
+    main(args.incremental)
@@ -10,10 +10,15 @@ BASE_DIR = environ.Path(__file__) - 2
 env = environ.Env()
 
 env.read_env(os.path.join(BASE_DIR, '.env'))
-MECAB_NUM = int(env('MECAB_NUM'))  # 環境依存定数
+ROMANAIZE_PROCESSES = os.cpu_count() or 1  # ローマ字変換に用いるプロセス数
 
 WAIT_TIME = 1
 
+PREFETCH_RATE = 1  # 店舗データの事前取得でのぐるなびAPIへの1秒あたりのリクエスト数
+PREFETCH_RANGE = 3  # 店舗データを事前取得する検索範囲(下車飯クラスの既定値)
+PREFETCH_REFRESH_AGE = 60 * 60 * 24 * 3  # 取得からこの秒数を過ぎた駅の店舗データを取得し直す
+PREFETCH_COMMIT_SIZE = 100  # 店舗データをまとめて保存する駅数
+
 CSV_STATION = "../station_data/station.csv"
 HEADERS = ['line_cd', 'station_cd', 'line_name', 'line_name_roman', 'station_name', 'station_name_roman', 'lat', 'lon']
 
@@ -1,52 +1,50 @@
 
-import re
+"""
+駅データ取り込み用の関数群を配置するモジュール
+ローマ字変換の処理(MeCab・kakasi)はアプリ(stopover_food_app.functions)と共通のものを用いる
+"""
+import sys
+import math
+from concurrent.futures import ProcessPoolExecutor
 
-import MeCab
-from pykakasi import kakasi
+from consts import BASE_DIR, ROMANAIZE_PROCESSES
 
-from consts import MECAB_NUM
+sys.path.append(str(BASE_DIR))
+from stopover_food_app.functions import get_romanaize_st, romanaize  # noqa: E402
 
+from typing import Dict, Iterable, List
 
-class RomanaizeST:
-    """
-    編集距離算出クラス
-    """
-    def __init__(self):
-        """
-        初期化メソッド
-        """
-        k = kakasi()
-        k.setMode('K', 'a')
-        self.conv = k.getConverter()
-        self.tagger = MeCab.Tagger('-d /var/lib/mecab/dic/debian')
 
-    def katakanize(self, text: str) -> str:
-        """
-        文字列をカタカナに変換する
+def _romanaize_names(names: List[str]) -> List[str]:
+    """
+    名称のリストをローマ字(アポストロフィ除去済み)に変換する(プロセスプールの各ワーカーで実行)
 
-        @return: カタカナ文字列
-        """
-        morphed = [re.split(r"[,\t\s\n]", w) for w in self.tagger.parse(text).split("\n")]
-        morphed.remove([""])
-        morphed.remove(["EOS"])
-        k = [morph[MECAB_NUM] if morph[MECAB_NUM] != "*" else morph[0] for morph in morphed]
+    @param names: 名称リスト
+    @return: ローマ字リスト
+    """
+    return [romanaize(name)[0].replace("'", "") for name in names]
 
-        return "".join(k)
 
-    def romanaize(self, text: str) -> list:
-        """
-        カタカナ文字列をローマ字にして返す
+def romanaize_batch(names: Iterable[str], processes: int = ROMANAIZE_PROCESSES) -> Dict[str, str]:
+    """
+    名称をまとめてローマ字(アポストロフィ除去済み)に変換する
+    重複を除いた名称をプロセス数で分割し、ワーカーごとのRomanaizeSTで並列に変換する
 
-        @return: ローマ字に変換済み文字列
-        """
-        katakana = self.katakanize(text)
+    @param names: 名称 e.g.) ['新宿', '横浜', '新宿', ...]
+    @param processes: プロセス数(1のときは自プロセスで変換)
+    @return: 名称 → ローマ字の辞書 e.g.) {'新宿': 'shinjuku', '横浜': 'yokohama'}
+    """
+    unique_names = list(dict.fromkeys(names))
+    if processes <= 1 or len(unique_names) <= processes:
+        return dict(zip(unique_names, _romanaize_names(unique_names)))
 
-        if type(katakana) == str:
-            katakana = [katakana]
+    chunk_size = math.ceil(len(unique_names) / processes)
+    chunks = [unique_names[i: i + chunk_size] for i in range(0, len(unique_names), chunk_size)]
+    with ProcessPoolExecutor(processes, initializer=get_romanaize_st) as e:
+        romans = [roman for chunk in e.map(_romanaize_names, chunks) for roman in chunk]
 
-        return [self.conv.do(k) for k in katakana]
+    return dict(zip(unique_names, romans))
 
 
 if __name__ == '__main__':
-    rs = RomanaizeST()
-    print(rs.romanaize("横浜"))
+    print(romanaize("横浜"))
@@ -0,0 +1,123 @@
+"""
+station_infoの全駅についてカテゴリーごとにぐるなびAPIで飲食店を検索し、
+フィルタ済みの店舗データを駅・カテゴリーごとにshop_snapshotテーブルへ保存するスクリプト
+(下車飯クラスはSHOP_SNAPSHOT_ENABLEDのとき、このテーブルに無い・古い駅だけぐるなびAPIに問い合わせる)
+とりあえず手動定期実行(app.pyで駅データを更新した後など)
+"""
+import sys
+from argparse import ArgumentParser
+
+import requests
+import pandas as pd
+import psycopg2
+
+from consts import BASE_DIR, DATABASE, PREFETCH_RATE, PREFETCH_RANGE, PREFETCH_REFRESH_AGE, PREFETCH_COMMIT_SIZE
+
+# 検索・フィルタ処理はアプリと同じものを用いる(店舗データの形式を揃えるため)
+sys.path.append(str(BASE_DIR))
+from stopover_food_app.consts import GURUNAVI_KEY  # noqa: E402
+from stopover_food_app.guruanvi import guruanvi_api  # noqa: E402
+from stopover_food_app.ratelimit import TokenBucket  # noqa: E402
+from stopover_food_app.shop_snapshot import create_table, fresh_station_cds, save_snapshots  # noqa: E402
+from stopover_food_app.stopover_food import CATEGORY_DICT  # noqa: E402
+
+from typing import Dict, List, Optional, Tuple
+
+
+def read_station_groups(conn) -> Dict[Tuple[str, float, float], List[int]]:
+    """
+    station_infoの駅を駅名・位置ごとにまとめる(乗換駅など同じ位置の駅は1回の検索で済ませる)
+
+    @param conn: DBコネクション
+    @return: (駅名, 緯度, 経度) → 駅コードのリスト
+    """
+    df = pd.read_sql("SELECT station_cd, station_name, lat, lon FROM station_info ORDER BY index;", conn)
+    groups = dict()
+    for station_cd, station_name, lat, lon in df.itertuples(index=False, name=None):
+        groups.setdefault((station_name, float(lat), float(lon)), list()).append(int(station_cd))
+
+    return groups
+
+
+def prefetch_category(conn, groups: Dict[Tuple[str, float, float], List[int]], category: str, range_: int,
+                      max_age: int, bucket: TokenBucket, limit: Optional[int] = None) -> Tuple[int, int]:
+    """
+    取得からmax_age秒以内の店舗データが無い駅について、カテゴリーの飲食店を検索して保存する
+    ぐるなびAPIへのリクエストはbucketのレートで逐次行い、PREFETCH_COMMIT_SIZE駅ごとにコミットする
+
+    @param conn: DBコネクション
+    @param groups: (駅名, 緯度, 経度) → 駅コードのリスト
+    @param category: カテゴリー(CATEGORY_DICTのキー) e.g.) 'ra-men'
+    @param range_: 検索範囲
+    @param max_age: 取得し直すまでの期間(秒)
+    @param bucket: リクエスト間隔を制御するトークンバケット
+    @param limit: 検索する駅数の上限(Noneのとき全駅)
+    @return: (保存した駅数, 失敗した駅数)
+    """
+    with conn:
+        fresh = fresh_station_cds(conn, category, range_, max_age)
+    targets = [(key, station_cds) for key, station_cds in groups.items() if not set(station_cds) <= fresh]
+    targets = targets[:limit] if limit is not None else targets
+    print(f"{category}: {len(groups)}駅中{len(targets)}駅を検索します")
+
+    saved, failed, records = 0, 0, list()
+    params = {'key': GURUNAVI_KEY, 'range': range_, 'keyword': CATEGORY_DICT[category]}
+    for (station_name, lat, lon), station_cds in targets:
+        bucket.acquire()
+        try:
+            shop_datas = guruanvi_api(dict(params, lat=lat, lng=lon, station=station_name))
+        except (requests.exceptions.RequestException, ValueError, KeyError) as ex:
+            # 失敗した駅は次回の実行で取得し直す(アプリはぐるなびAPIに問い合わせる)
+            print(f"  失敗: {station_name} {type(ex).__name__}: {ex}")
+            failed += 1
+            continue
+
+        # 店舗が無い駅も空のリストとして保存し、アプリから問い合わせないようにする
+        records.extend((station_cd, category, range_, shop_datas) for station_cd in station_cds)
+        saved += 1
+        if len(records) >= PREFETCH_COMMIT_SIZE:
+            with conn:
+                save_snapshots(conn, records)
+            records = list()
+
+    if records:
+        with conn:
+            save_snapshots(conn, records)
+
+    return saved, failed
+
+
+def main(categories: List[str], range_: int = PREFETCH_RANGE, max_age: int = PREFETCH_REFRESH_AGE,
+         limit: Optional[int] = None):
+    """
+    メインスクリプト
+
+    @param categories: 検索するカテゴリー(CATEGORY_DICTのキー)のリスト
+    @param range_: 検索範囲
+    @param max_age: 取得し直すまでの期間(秒)
+    @param limit: カテゴリーごとに検索する駅数の上限(Noneのとき全駅)
+    """
+    conn = psycopg2.connect(**DATABASE)
+    try:
+        with conn:
+            create_table(conn)
+            groups = read_station_groups(conn)
+
+        bucket = TokenBucket(PREFETCH_RATE, 1)
+        for category in categories:
+            saved, failed = prefetch_category(conn, groups, category, range_, max_age, bucket, limit)
+            print(f"{category}: 保存: {saved}駅, 失敗: {failed}駅")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='全駅の飲食店をぐるなびAPIで検索してshop_snapshotテーブルに保存する')
+    parser.add_argument('--category', action='append', choices=list(CATEGORY_DICT),
+                        help='検索するカテゴリー(複数指定可、default: 全カテゴリー)')
+    parser.add_argument('--range', type=int, default=PREFETCH_RANGE, help='検索範囲')
+    parser.add_argument('--max-age', type=int, default=PREFETCH_REFRESH_AGE,
+                        help='取得からこの秒数以内の駅は検索しない(0のとき全駅を取得し直す)')
+    parser.add_argument('--limit', type=int, default=None, help='カテゴリーごとに検索する駅数の上限')
+    args = parser.parse_args()
+    main(args.category or list(CATEGORY_DICT), args.range, args.max_age, args.limit)
@@ -0,0 +1,236 @@
+"""
+ぐるなびAPI・店舗ページへの問い合わせをasyncioで行う関数を配置するモジュール(ASGI用)
+urlの作成・レスポンスの整形・キャッシュキーは同期版(guruanvi.py)と共通
+"""
+import asyncio
+import json
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .consts import (CONNECT_TIMEOUT, READ_TIMEOUT, POOL_MAXSIZE, IMAGE_CACHE_ALIAS, IMAGE_CACHE_TTL,
+                     IMAGE_NEGATIVE_CACHE_TTL)
+from .guruanvi import HIT_PER_PAGE, MAX_RETRY_COUNT, build_url, filter_shops, restamp_station, parse_img, image_cache_key
+from .http_client import HttpClient, RETRY_STATUS_CODES
+from .ratelimit import get_rate_limiter
+from .shop_cache import ShopCache, get_shop_cache
+from .singleflight import get_single_flight
+from .metrics import count
+
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+IMG_CONCURRENCY = 5  # 画像スクレイピングの同時実行数(同期版のスレッド数と同じ)
+
+# AsyncClientは作成したイベントループでしか使えないため、ループごとに1つ保持する
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    実行中のイベントループで共有する非同期HTTPクライアントを返す
+
+    @return: httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE)
+        )
+
+    return client
+
+
+async def get_response(url: str, max_retry: int = MAX_RETRY_COUNT,
+                       retry_status_codes: Iterable[int] = RETRY_STATUS_CODES) -> httpx.Response:
+    """
+    GETリクエストを送りレスポンスを返す(HttpClient.getの非同期版)
+    接続エラー・タイムアウト・retry_status_codesのときはバックオフしてリトライ
+
+    @param url: URL
+    @param max_retry: 最大試行回数
+    @param retry_status_codes: リトライ対象のステータスコード
+    @return: レスポンス(最後の試行がエラーのときは例外を送出)
+    """
+    response = None
+    for retry in range(max_retry):
+        if retry > 0:
+            count('async_retries')
+            await asyncio.sleep(HttpClient.backoff(retry - 1))
+        count('async_requests')
+        try:
+            response = await get_async_client().get(url)
+        except httpx.TransportError:  # 接続エラー・タイムアウト
+            count('async_errors')
+            if retry == max_retry - 1:
+                raise
+            continue
+        if response.status_code not in retry_status_codes:
+            return response
+
+    return response
+
+
+async def search(params: dict) -> Tuple[List[list], int]:
+    """
+    1ページ目の飲食店データと検索結果の総件数を返す関数(guruanvi.searchの非同期版)
+
+    @param params: パラメータ辞書 e.g.) {"key": API key, "lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン'}
+    @return: (飲食店データリスト, 検索結果の総件数(カテゴリーで絞り込む前))
+    """
+    response = await get_response(build_url(params))
+
+    # 指定された条件の店舗が存在しない
+    if response.status_code == 404:
+        count('gurunavi_404')
+        return list(), 0
+
+    result = json.loads(response.text)
+
+    return filter_shops(params, result['rest']), int(result.get('total_hit_count', 0))
+
+
+async def guruanvi_api(params: dict) -> List[list]:
+    """
+    ぐるなびAPIを用いて飲食店を検索する関数(guruanvi.guruanvi_apiの非同期版)
+
+    @param params: パラメータ辞書 e.g.) {"key": API key, "lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン'}
+    @return: 飲食店データリスト
+    """
+    return (await search(params))[0]
+
+
+async def merged_guruanvi_api(params: dict) -> dict:
+    """
+    複数駅をまとめた問い合わせ用に、ぐるなびAPIで飲食店を検索する関数(guruanvi.merged_guruanvi_apiの非同期版)
+
+    @param params: パラメータ辞書
+    @return: {'shops': 飲食店データリスト(1ページに収まらない場合はNone)}
+    """
+    shop_datas, total_hit_count = await search(params)
+
+    return {'shops': shop_datas if total_hit_count <= HIT_PER_PAGE else None}
+
+
+async def cached_guruanvi_api(params: dict) -> List[list]:
+    """
+    キャッシュを通してぐるなびAPIで飲食店を検索する関数(guruanvi.cached_guruanvi_apiの非同期版)
+    キャッシュのバックエンドはファイル・memcached等の場合があるため、読み書きはスレッドで行う
+    同じキーの取得が同じイベントループ内で実行中の場合は、その結果を待つ
+
+    @param params: パラメータ辞書
+    @return: 飲食店データリスト
+    """
+    shop_datas = await _get_or_fetch(params, guruanvi_api)
+
+    return restamp_station(params, shop_datas)
+
+
+async def cached_merged_guruanvi_api(params: dict) -> Optional[List[list]]:
+    """
+    キャッシュを通して複数駅をまとめた問い合わせを行う関数(guruanvi.cached_merged_guruanvi_apiの非同期版)
+
+    @param params: パラメータ辞書(params['merged']がTrue)
+    @return: 飲食店データリスト(1ページに収まらない場合はNone)
+    """
+    return (await _get_or_fetch(params, merged_guruanvi_api))['shops']
+
+
+async def _get_or_fetch(params: dict, fetch: Callable[[dict], Awaitable]):
+    """
+    キャッシュに無ければfetchで取得して保存し、店舗データを返す(ShopCache.get_or_fetchの非同期版)
+    同じキーの取得が同じイベントループ内で実行中の場合は、その結果を待つ
+
+    @param params: パラメータ辞書
+    @param fetch: 店舗データを取得するコルーチン関数
+    @return: 店舗データ
+    """
+    shop_datas = await sync_to_async(get_shop_cache().get)(params)
+    if shop_datas is None:
+        shop_datas = await get_single_flight('gurunavi').do_async(ShopCache.make_key(params), _fetch_and_set,
+                                                                  params, fetch)
+
+    return shop_datas
+
+
+async def _fetch_and_set(params: dict, fetch: Callable[[dict], Awaitable]):
+    """
+    fetchで取得した店舗データをキャッシュに保存して返す
+    (直前に他の処理が保存していればぐるなびAPIに問い合わせずにそれを返す)
+
+    @param params: パラメータ辞書
+    @param fetch: 店舗データを取得するコルーチン関数
+    @return: 店舗データ
+    """
+    shop_cache = get_shop_cache()
+    shop_datas = await sync_to_async(shop_cache.cache.get)(shop_cache.make_key(params))
+    if shop_datas is None:
+        shop_datas = await fetch(params)
+        await sync_to_async(shop_cache.set)(params, shop_datas)
+
+    return shop_datas
+
+
+async def scrape_img(url: str) -> str:
+    """
+    店舗ページをスクレイピングして店舗画像のurlを返す(guruanvi.scrape_imgの非同期版)
+    レートリミッタの待機はスレッドを止めずにawaitで行う
+
+    @param url: 店舗ページのurl
+    @return: 店舗画像のurl(画像が無い店舗・店舗ページが無い(404)場合は'')
+    """
+    wait = get_rate_limiter().reserve(url)
+    if wait > 0:
+        await asyncio.sleep(wait)
+    response = await get_response(url, max_retry=1)
+    if response.status_code == 404:
+        return ''
+    # 5xx・429・403等は画像が無いとは限らないため、例外にして保存しない
+    response.raise_for_status()
+
+    # htmlの解析はCPU処理のためイベントループの外で行う
+    return await sync_to_async(parse_img)(response.text)
+
+
+async def get_src(store_data: dict) -> dict:
+    """
+    個別の店舗情報に店舗画像のurlを追加して返す(guruanvi.get_srcの非同期版)
+
+    @param store_data: 店舗情報
+    @return: 画像情報を追加した店舗情報
+    """
+    if not (store_data['url'] and store_data['img'] == ''):
+        return store_data
+
+    cache = caches[IMAGE_CACHE_ALIAS]
+    key = image_cache_key(store_data['url'])
+    img = await sync_to_async(cache.get)(key)
+    count('image_cache_misses' if img is None else 'image_cache_hits')
+    if img is None:
+        try:
+            img = await scrape_img(store_data['url'])
+        except Exception:
+            # 通信エラー・404以外のエラーステータスは保存せず次回再取得する
+            return store_data
+        await sync_to_async(cache.set)(key, img, IMAGE_CACHE_TTL if img else IMAGE_NEGATIVE_CACHE_TTL)
+    store_data['img'] = img
+
+    return store_data
+
+
+async def get_img(data: list) -> list:
+    """
+    ぐるなびから画像をスクレイピングして飲食店情報に加える関数(guruanvi.get_imgの非同期版)
+
+    @param data: 飲食店情報の辞書のリスト
+    @return: 画像情報を加えた飲食店情報の辞書のリスト
+    """
+    semaphore = asyncio.Semaphore(IMG_CONCURRENCY)
+
+    async def _get_src(store_data: dict) -> dict:
+        async with semaphore:
+            return await get_src(store_data)
+
+    return list(await asyncio.gather(*[_get_src(store_data) for store_data in data]))
@@ -1,17 +1,69 @@
 """
 定数配置モジュール
 """
+import os
 import environ
 
+BASE_DIR = environ.Path(__file__) - 2
+
 env = environ.Env()
 
-env.read_env('.env')
+# deploy_stationのバッチからも読み込むため、.envはリポジトリ直下のものを読む
+env.read_env(os.path.join(BASE_DIR, '.env'))
 
 GURUNAVI_KEY = env('GURUNAVI_KEY')
+GURUNAVI_API_BASE = env('GURUNAVI_API_BASE', default='https://api.gnavi.co.jp/RestSearchAPI/v3/')  # ベンチマーク時は偽サーバ
 MECAB_NUM = int(env('MECAB_NUM'))  # 環境依存定数
+ROMANAIZE_CACHE_SIZE = 4096  # ローマ字変換結果をメモ化する件数
 
 MAX_WAIT_TIME = 10
 WAIT_TIME = 0.5
+MAX_API_WORKERS = 8  # ぐるなびAPIへの同時リクエスト数の上限
+QUERY_PLANNING = True  # 検索円が重なる隣り合う駅のぐるなびAPIへの問い合わせをまとめるか否か
+
+CONNECT_TIMEOUT = 3.05  # 接続タイムアウト(秒)
+READ_TIMEOUT = MAX_WAIT_TIME  # 読み込みタイムアウト(秒)
+POOL_CONNECTIONS = 4  # コネクションプールを保持するホスト数
+POOL_MAXSIZE = MAX_API_WORKERS  # ホストごとに保持するコネクション数
+BACKOFF_BASE = 0.5  # リトライ時の指数バックオフの基準待機時間(秒)
+BACKOFF_MAX = 4  # リトライ時の最大待機時間(秒)
+
+SHOP_CACHE_ALIAS = 'gurunavi'  # 店舗データを保存するsettings.CACHESのキャッシュ名
+SHOP_CACHE_TTL = int(env('SHOP_CACHE_TTL', default=60 * 60 * 6))  # 店舗データキャッシュの有効期間(秒)
+SHOP_CACHE_TRACKED_KEYS = 10000  # 追い出しを数えるために保存したキーを覚えておく件数
+SINGLE_FLIGHT_ENABLED = True  # 同時に要求された同じ検索・ぐるなびAPIへの問い合わせを1回にまとめるか否か
+
+SNAPSHOT_CACHE_ALIAS = 'snapshot'  # 検索結果スナップショットを保存するsettings.CACHESのキャッシュ名
+SNAPSHOT_TTL = 60 * 10  # 検索結果スナップショットの有効期間(秒)
+
+IMAGE_CACHE_ALIAS = 'shop_image'  # 店舗url → 画像urlの対応を保存するsettings.CACHESのキャッシュ名
+IMAGE_CACHE_TTL = 60 * 60 * 24 * 7  # 画像urlキャッシュの有効期間(秒)
+IMAGE_NEGATIVE_CACHE_TTL = 60 * 60 * 24  # 画像が無い店舗のキャッシュの有効期間(秒)
+SCRAPE_RATE = 10  # スクレイピング先ホストごとの1秒あたりのリクエスト数(従来の5スレッド × 0.5秒待機と同じ)
+SCRAPE_BURST = 5  # スクレイピング先ホストごとのバースト数(従来の同時スクレイピング数と同じ)
+
+FUZZY_MAX_DISTANCE = 8  # 「もしかして」候補とする路線名・駅名(ローマ字)のレーベンシュタイン距離の上限
+TRANSFER_MAX_DISTANCE = 500  # 同じ駅名の他路線の駅を乗換駅とみなす距離の上限(m)
+TRANSFER_PENALTY = 3000  # 経路探索で乗換1回を駅間距離に換算した重み(m)
+STATION_INDEX_CHECK_INTERVAL = 60  # station_infoの更新を確認して駅情報索引を作り直す間隔(秒)
+LOOP_GAP_FACTOR = 1.5  # 始点・終点の駅間距離が路線内の駅間距離の中央値のこの倍数以内の路線を環状線の候補とする
+NEAREST_CELL = 0.01  # 最寄り駅索引の格子の間隔(度)
+NEAREST_K = 5  # 最寄り駅検索で返す駅数
+NEAREST_MAX_K = 20  # 最寄り駅検索で指定できる駅数の上限
+NEAREST_MAX_DISTANCE = 30000  # 最寄り駅を探索する距離の上限(m)
+
+METRICS_ENABLED = True  # ステージごとの処理時間・カウンタを記録するか否か
+METRICS_WINDOW = 1024  # ステージごとの処理時間の分位点を求める直近の件数
+
+SHOP_SNAPSHOT_ENABLED = env.bool('SHOP_SNAPSHOT_ENABLED', default=False)  # 事前取得した店舗データを用いるか否か
+SHOP_SNAPSHOT_TABLE = 'shop_snapshot'  # 駅・カテゴリーごとの事前取得した店舗データのテーブル名
+SHOP_SNAPSHOT_MAX_AGE = 60 * 60 * 24 * 7  # 事前取得した店舗データを用いる期間(秒)、過ぎた駅はぐるなびAPIに問い合わせる
+SHOP_SNAPSHOT_POOL_MINSIZE = 2  # 店舗データの読み込みで接続したまま保持するDBコネクション数
+SHOP_SNAPSHOT_POOL_MAXSIZE = MAX_API_WORKERS  # 店舗データの読み込みで同時に用いるDBコネクション数の上限
+
+PAGE_NUM = 15  # 1ページあたりの表示件数
+LAZY_FETCH = True  # 表示するページに必要な分の駅だけを検索するか否か
+LAZY_LOOKAHEAD = 5  # 表示するページの店舗数に加えて先読みする店舗数
 
 DATABASE = {
     "dbname": env('DBNAME'),
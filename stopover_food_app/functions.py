@@ -2,11 +2,15 @@
 共通関数群を配置するモジュール
 """
 import re
+import threading
+from functools import lru_cache
 
 import MeCab
 from pykakasi import kakasi
 
-from .consts import MECAB_NUM
+from .consts import MECAB_NUM, ROMANAIZE_CACHE_SIZE
+
+from typing import Optional
 
 
 class RomanaizeST:
@@ -21,6 +25,7 @@ class RomanaizeST:
         k.setMode('K', 'a')
         self.conv = k.getConverter()
         self.tagger = MeCab.Tagger('-d /var/lib/mecab/dic/debian')
+        self._lock = threading.Lock()  # MeCab.Tagger・kakasiは同一インスタンスを複数スレッドで同時に使えないため
 
     def katakanize(self, text: str) -> str:
         """
@@ -28,7 +33,9 @@ class RomanaizeST:
 
         @return: カタカナ文字列
         """
-        morphed = [re.split(r"[,\t\s\n]", w) for w in self.tagger.parse(text).split("\n")]
+        with self._lock:
+            parsed = self.tagger.parse(text)
+        morphed = [re.split(r"[,\t\s\n]", w) for w in parsed.split("\n")]
         morphed.remove([""])
         morphed.remove(["EOS"])
         k = [morph[MECAB_NUM] if morph[MECAB_NUM] != "*" else morph[0] for morph in morphed]
@@ -46,9 +53,57 @@ class RomanaizeST:
         if type(katakana) == str:
             katakana = [katakana]
 
-        return [self.conv.do(k) for k in katakana]
+        with self._lock:
+            return [self.conv.do(k) for k in katakana]
+
+
+_romanaize_st: Optional[RomanaizeST] = None
+_lock = threading.Lock()
+
+
+def get_romanaize_st() -> RomanaizeST:
+    """
+    プロセス内で共有するRomanaizeSTを返す(MeCab.Taggerの作成は重いため初回呼び出し時に一度だけ作成する)
+
+    @return: RomanaizeST
+    """
+    global _romanaize_st
+    if _romanaize_st is None:
+        with _lock:
+            if _romanaize_st is None:
+                _romanaize_st = RomanaizeST()
+
+    return _romanaize_st
+
+
+@lru_cache(maxsize=ROMANAIZE_CACHE_SIZE)
+def katakanize(text: str) -> str:
+    """
+    共有のRomanaizeSTで文字列をカタカナに変換する(結果はメモ化)
+
+    @return: カタカナ文字列
+    """
+    return get_romanaize_st().katakanize(text)
+
+
+@lru_cache(maxsize=ROMANAIZE_CACHE_SIZE)
+def _romanaize(text: str) -> tuple:
+    """
+    共有のRomanaizeSTで文字列をローマ字に変換する(結果はメモ化)
+
+    @return: ローマ字に変換済み文字列のタプル
+    """
+    return tuple(get_romanaize_st().romanaize(text))
+
+
+def romanaize(text: str) -> list:
+    """
+    共有のRomanaizeSTで文字列をローマ字に変換する(結果はメモ化)
+
+    @return: ローマ字に変換済み文字列
+    """
+    return list(_romanaize(text))
 
 
 if __name__ == '__main__':
-    rs = RomanaizeST()
-    print(rs.romanaize("横浜"))
+    print(romanaize("横浜"))
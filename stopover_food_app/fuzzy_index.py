@@ -0,0 +1,139 @@
+"""
+ローマ字の路線名・駅名からレーベンシュタイン距離の近い名称を探すためのBK木を配置するモジュール
+"""
+import heapq
+from Levenshtein import distance as levenshtein
+
+from typing import Dict, List, Tuple
+
+
+class BKTree:
+    """
+    BK木クラス
+    編集距離の三角不等式を使い、全件との距離計算をせずに近い名称を探す
+    """
+    def __init__(self):
+        """
+        初期化メソッド
+        """
+        self.root = None  # [ローマ字, 名称リスト, {距離: 子ノード}]
+        self.size = 0
+
+    def add(self, word: str, name: str) -> None:
+        """
+        ローマ字と名称を追加する(同じローマ字の名称は同じノードにまとめる)
+
+        @param word: ローマ字 e.g.) 'yokohama'
+        @param name: 名称 e.g.) '横浜'
+        """
+        entry = (self.size, name)  # 追加順(距離が同じときの並び順)と名称
+        self.size += 1
+        if self.root is None:
+            self.root = [word, [entry], dict()]
+            return
+
+        node = self.root
+        while True:
+            dist = levenshtein(word, node[0])
+            if dist == 0:
+                node[1].append(entry)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [word, [entry], dict()]
+                return
+            node = child
+
+    def nearest(self, word: str, k: int, max_dist: int) -> List[Tuple[int, str]]:
+        """
+        距離がmax_dist以下の名称を近い順に最大k個返す
+
+        @param word: ローマ字
+        @param k: 返す個数
+        @param max_dist: 距離の上限
+        @return: [(距離, 名称), ...]
+        """
+        if self.root is None:
+            return list()
+
+        best = list()  # (-距離, -追加順, 名称)の最大ヒープ(k個)
+        radius = max_dist
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = levenshtein(word, node[0])
+            if dist <= radius:
+                for order, name in node[1]:
+                    item = (-dist, -order, name)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                if len(best) == k:
+                    # k個見つかった後はk番目の距離より遠いノードを探索しない
+                    radius = -best[0][0]
+            for child_dist, child in node[2].items():
+                if dist - radius <= child_dist <= dist + radius:
+                    stack.append(child)
+
+        return [(-d, name) for d, _, name in sorted(best, reverse=True)]
+
+
+class FuzzyIndex:
+    """
+    路線名・路線ごとの駅名のBK木をまとめた索引クラス
+    """
+    def __init__(self, line_romans: Dict[str, str], station_romans: Dict[str, List[Tuple[str, str]]]):
+        """
+        初期化メソッド
+
+        @param line_romans: 路線名 → 路線名(ローマ字)
+        @param station_romans: 路線名 → [(駅名, 駅名(ローマ字)), ...]
+        """
+        self.line_names = list(line_romans.keys())
+        self.line_tree = BKTree()
+        for line, roman in line_romans.items():
+            self.line_tree.add(roman, line)
+
+        self.station_trees = dict()
+        for line, stations in station_romans.items():
+            tree = BKTree()
+            for station, roman in stations:
+                tree.add(roman, station)
+            self.station_trees[line] = tree
+
+    def similar_lines(self, roman: str, k: int, max_dist: int) -> List[str]:
+        """
+        入力に近い路線名を返す
+
+        @param roman: 入力された路線名のローマ字
+        @param k: 返す個数
+        @param max_dist: 距離の上限
+        @return: 路線名リスト
+        """
+        return [line for _, line in self.line_tree.nearest(roman, k, max_dist)]
+
+    def partial_match_lines(self, text: str) -> List[str]:
+        """
+        入力を含む路線名を返す(ローマ字変換せずに済むため、距離計算より先に確認する)
+
+        @param text: 入力された路線名
+        @return: 路線名リスト
+        """
+        return [line for line in self.line_names if text in line]
+
+    def similar_stations(self, line: str, roman: str, k: int, max_dist: int) -> List[str]:
+        """
+        路線内で入力に近い駅名を返す
+
+        @param line: 路線名
+        @param roman: 入力された駅名のローマ字
+        @param k: 返す個数
+        @param max_dist: 距離の上限
+        @return: 駅名リスト
+        """
+        tree = self.station_trees.get(line)
+        if tree is None:
+            return list()
+
+        return [station for _, station in tree.nearest(roman, k, max_dist)]
@@ -2,19 +2,24 @@
 ぐるなびAPIを用いて飲食店情報を取得する関数を配置するモジュール(Ver.1はラーメン専用)
 """
 import re
-from time import sleep
+import hashlib
 from concurrent.futures import ThreadPoolExecutor
-from geopy.distance import geodesic
 import requests
 from bs4 import BeautifulSoup
 import json
+from django.core.cache import caches
 
-from .consts import GURUNAVI_KEY
+from .consts import GURUNAVI_KEY, GURUNAVI_API_BASE, IMAGE_CACHE_ALIAS, IMAGE_CACHE_TTL, IMAGE_NEGATIVE_CACHE_TTL
+from .http_client import get_client
+from .ratelimit import get_rate_limiter
+from .distance import distances
+from .shop_cache import get_shop_cache
+from .metrics import count
 
-from typing import List
+from typing import List, Optional, Tuple
 
 MAX_RETRY_COUNT = 3
-WAIT_TIME = 1
+HIT_PER_PAGE = 100
 REGULAR_CATEGORY_DICT = {'ラーメン': r'ラーメン|らーめん|油そば|坦々麺|タンタン|たんたん|拉麺',
                          'カフェ': r'カフェ|喫茶店|コーヒー'}
 
@@ -22,20 +27,30 @@ REGULAR_CATEGORY_DICT = {'ラーメン': r'ラーメン|らーめん|油そば|
 def get_response(url: str) -> requests:
     """
     ぐるなびAPIにrequestsを送りレスポンスを返す関数
-    status_codeが500のときはリトライ
+    status_codeが5xxのとき・接続エラーのときは共有クライアントがバックオフしてリトライ
 
     @param url: ぐるなびAPIのurl
     """
-    response = None
-    for retry in range(MAX_RETRY_COUNT):
-        response = requests.get(url)
-        if response.status_code == 500:
-            sleep(WAIT_TIME)
-            continue
-        else:
-            return response
+    return get_client().get(url, max_retry=MAX_RETRY_COUNT)
 
-    return response
+
+def search(params: dict) -> Tuple[List[list], int]:
+    """
+    ぐるなびAPIを用いて飲食店を検索し、1ページ目(最大HIT_PER_PAGE件)の飲食店データと検索結果の総件数を返す関数
+
+    @param params: パラメータ辞書 e.g.) {"key": API key, "lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン'}
+    @return: (飲食店データリスト, 検索結果の総件数(カテゴリーで絞り込む前))
+    """
+    response = get_response(build_url(params))
+
+    # 指定された条件の店舗が存在しない
+    if response.status_code == 404:
+        count('gurunavi_404')
+        return list(), 0
+
+    result = json.loads(response.text)
+
+    return filter_shops(params, result['rest']), int(result.get('total_hit_count', 0))
 
 
 def guruanvi_api(params: dict) -> List[list]:
@@ -45,66 +60,193 @@ def guruanvi_api(params: dict) -> List[list]:
     @param params: パラメータ辞書 e.g.) {"key": API key, "lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン'}
     @return: 飲食店データリスト e.g.) [[店舗名称, 店舗URL, 住所, ..., 'ぐるなび'], [店舗名称, 店舗URL, ... ,'ぐるなび'], ...]
     """
-    shop_datas = list()
-    api_base = 'https://api.gnavi.co.jp/RestSearchAPI/v3/?'
-    api_params = 'keyid={key}&latitude={lat}&longitude={lng}&range={range_}&freeword={keyword}&hit_per_page=100'
-    url = api_base + api_params.format(
+    return search(params)[0]
+
+
+def merged_guruanvi_api(params: dict) -> dict:
+    """
+    複数駅をまとめた問い合わせ用に、ぐるなびAPIで飲食店を検索する関数
+    検索結果が1ページに収まらない場合、まとめた各駅の店舗をすべて含むとは限らないため店舗データを返さない
+    (1ページに収まる場合は、含まれる各駅の検索結果も1ページに収まり、駅ごとに問い合わせた場合と同じ店舗になる)
+
+    @param params: パラメータ辞書
+    @return: {'shops': 飲食店データリスト(1ページに収まらない場合はNone)}
+    """
+    shop_datas, total_hit_count = search(params)
+
+    return {'shops': shop_datas if total_hit_count <= HIT_PER_PAGE else None}
+
+
+def build_url(params: dict, page: int = 1) -> str:
+    """
+    ぐるなびAPIのurlを作成する関数
+
+    @param params: パラメータ辞書
+    @param page: 取得するページ(1始まり)
+    @return: ぐるなびAPIのurl
+    """
+    api_base = GURUNAVI_API_BASE + '?'
+    api_params = ('keyid={key}&latitude={lat}&longitude={lng}&range={range_}&freeword={keyword}'
+                  '&hit_per_page={hit_per_page}&offset_page={page}')
+
+    return api_base + api_params.format(
         key=params['key'],
         lat=params['lat'],
         lng=params['lng'],
         range_=params['range'],
-        keyword=params['keyword']
+        keyword=params['keyword'],
+        hit_per_page=HIT_PER_PAGE,
+        page=page
     )
-    response = get_response(url)
 
-    # 指定された条件の店舗が存在しない
-    if response.status_code == 404:
+
+def filter_shops(params: dict, result_list: List[dict]) -> List[list]:
+    """
+    ぐるなびAPIの検索結果からキーワードのカテゴリーの店舗を抽出し、飲食店データリストにする関数
+
+    @param params: パラメータ辞書
+    @param result_list: ぐるなびAPIのレスポンスの'rest'
+    @return: 飲食店データリスト
+    """
+    shop_datas = list()
+    # キーワード以外のカテゴリーのものが検索結果に含まれるため、カテゴリーにキーワードの関連カテゴリーを含む場合のみ抽出
+    result_list = [shop for shop in result_list if re.search(REGULAR_CATEGORY_DICT[params['keyword']], shop['category'])]
+    if len(result_list) == 0:
         return shop_datas
 
-    result_list = json.loads(response.text)['rest']
-    for shop_data in result_list:
-        # キーワード以外のカテゴリーのものが検索結果に含まれるため、カテゴリーにキーワードの関連カテゴリーを含む場合のみ抽出
-        if re.search(REGULAR_CATEGORY_DICT[params['keyword']], shop_data['category']):
-            shop_datas.append(
-                [
-                    shop_data["name"],  # 0. 店舗名称
-                    shop_data["url"],  # 1. PCサイトURL
-                    shop_data["address"],  # 2. 住所
-                    shop_data['tel'],  # 3. 電話番号
-                    shop_data['opentime'],  # 4. 営業時間
-                    shop_data['holiday'],  # 5. 休業日
-                    shop_data["budget"],  # 6. 平均予算
-                    shop_data['access']['station'],  # 7. 駅名
-                    shop_data['access']['walk'],  # 8. 徒歩(分)
-                    shop_data['pr']['pr_short'],  # 9. PR文(短)
-                    shop_data["image_url"]['shop_image1'],  # 10. 店舗画像１のurl
-                    shop_data['category'],  # 11. カテゴリー
-                    params['station'] + '駅',  # 12. 駅名(固定)
-                    geodesic((params['lat'], params['lng']), (shop_data['latitude'], shop_data['longitude'])).m,
-                    "ぐるなび"
-                ]
-            )
+    # 検索地点から各店舗までの距離をまとめて計算
+    lats = [float(shop_data['latitude']) for shop_data in result_list]
+    lngs = [float(shop_data['longitude']) for shop_data in result_list]
+    dists = distances(params['lat'], params['lng'], lats, lngs).tolist()
+
+    for shop_data, lat, lng, dist in zip(result_list, lats, lngs, dists):
+        shop_datas.append(
+            [
+                shop_data["name"],  # 0. 店舗名称
+                shop_data["url"],  # 1. PCサイトURL
+                shop_data["address"],  # 2. 住所
+                shop_data['tel'],  # 3. 電話番号
+                shop_data['opentime'],  # 4. 営業時間
+                shop_data['holiday'],  # 5. 休業日
+                shop_data["budget"],  # 6. 平均予算
+                shop_data['access']['station'],  # 7. 駅名
+                shop_data['access']['walk'],  # 8. 徒歩(分)
+                shop_data['pr']['pr_short'],  # 9. PR文(短)
+                shop_data["image_url"]['shop_image1'],  # 10. 店舗画像１のurl
+                shop_data['category'],  # 11. カテゴリー
+                params['station'] + '駅',  # 12. 駅名(固定)
+                dist,  # 13. 検索地点からの距離(m)
+                "ぐるなび",
+                lat,  # 15. 緯度
+                lng,  # 16. 経度
+                shop_data['id'],  # 17. 店舗ID
+            ]
+        )
 
     return shop_datas
 
 
+def cached_guruanvi_api(params: dict) -> List[list]:
+    """
+    キャッシュを通してぐるなびAPIで飲食店を検索する関数
+    (lat, lng, range, keyword)が同じ検索はキャッシュ済みのフィルタ済み店舗データを返す
+
+    @param params: パラメータ辞書 e.g.) {"key": API key, "lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン'}
+    @return: 飲食店データリスト(guruanvi_apiと同じ形式)
+    """
+    shop_datas = get_shop_cache().get_or_fetch(params, guruanvi_api)
+
+    return restamp_station(params, shop_datas)
+
+
+def cached_merged_guruanvi_api(params: dict) -> Optional[List[list]]:
+    """
+    キャッシュを通して複数駅をまとめた問い合わせを行う関数
+    (1ページに収まらなかったことも保存し、次回からはまとめた問い合わせを行わない)
+
+    @param params: パラメータ辞書(params['merged']がTrue)
+    @return: 飲食店データリスト(1ページに収まらない場合はNone)
+    """
+    return get_shop_cache().get_or_fetch(params, merged_guruanvi_api)['shops']
+
+
+def restamp_station(params: dict, shop_datas: List[list]) -> List[list]:
+    """
+    駅名はキャッシュのキーに含まないため、呼び出し元の駅名で上書きしたコピーを返す
+
+    @param params: パラメータ辞書
+    @param shop_datas: キャッシュ済みの飲食店データリスト
+    @return: 飲食店データリスト
+    """
+    return [shop_data[:12] + [params['station'] + '駅'] + shop_data[13:] for shop_data in shop_datas]
+
+
+def scrape_img(url: str) -> str:
+    """
+    店舗ページをスクレイピングして店舗画像のurlを返す
+    リクエスト間隔はホストごとのレートリミッタで全スレッド共通に制御する
+
+    @param url: 店舗ページのurl
+    @return: 店舗画像のurl(画像が無い店舗・店舗ページが無い(404)場合は'')
+    """
+    get_rate_limiter().acquire(url)
+    response = get_client().get(url, max_retry=1)
+    if response.status_code == 404:
+        return ''
+    # 5xx・429・403等は画像が無いとは限らないため、例外にして保存しない
+    response.raise_for_status()
+
+    return parse_img(response.text)
+
+
+def parse_img(html: str) -> str:
+    """
+    店舗ページのhtmlから店舗画像のurlを取り出す
+
+    @param html: 店舗ページのhtml
+    @return: 店舗画像のurl(画像が無い店舗は'')
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    try:
+        img = soup.find('div', id='motif-slider-main').find('img').attrs['src']
+    except (AttributeError, KeyError):
+        return ''
+
+    return 'https:' + img
+
+
+def image_cache_key(url: str) -> str:
+    """
+    店舗url → 画像urlのキャッシュキーを返す
+
+    @param url: 店舗ページのurl
+    @return: キャッシュキー
+    """
+    return 'shop_image:' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
 def get_src(store_data) -> dict:
     """
     個別の店舗情報からscrタグを取得、店舗情報に追加して返す
+    店舗url → 画像urlの対応はキャッシュに保存する(画像が無い店舗・404も''として短めの期間保存する)
 
     @param store_data: 店舗情報
     @return: 画像情報を追加した店舗情報
     """
     if store_data['url'] and store_data['img'] == '':
-        try:
-            response = requests.get(store_data['url'], timeout=(3.0, 3)).text
-            sleep(0.5)
-            soup = BeautifulSoup(response, 'html.parser')
-            img = soup.find('div', id='motif-slider-main').find('img').attrs['src']
-            store_data['img'] = 'https:' + img
-            return store_data
-        except Exception:
-            return store_data
+        cache = caches[IMAGE_CACHE_ALIAS]
+        key = image_cache_key(store_data['url'])
+        img = cache.get(key)
+        count('image_cache_misses' if img is None else 'image_cache_hits')
+        if img is None:
+            try:
+                img = scrape_img(store_data['url'])
+            except Exception:
+                # 通信エラー・404以外のエラーステータスは保存せず次回再取得する
+                return store_data
+            cache.set(key, img, IMAGE_CACHE_TTL if img else IMAGE_NEGATIVE_CACHE_TTL)
+        store_data['img'] = img
+        return store_data
     else:
         return store_data
 
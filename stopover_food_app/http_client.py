@@ -0,0 +1,132 @@
+"""
+ぐるなびAPI・店舗ページへのHTTPリクエストに用いる共有クライアントを配置するモジュール
+ホストごとのコネクションプール(keep-alive)を全スレッドで使い回す
+"""
+import random
+import threading
+from time import sleep
+import requests
+from requests.adapters import HTTPAdapter
+
+from .consts import CONNECT_TIMEOUT, READ_TIMEOUT, POOL_CONNECTIONS, POOL_MAXSIZE, BACKOFF_BASE, BACKOFF_MAX
+
+from typing import Iterable, Optional
+
+MAX_RETRY_COUNT = 3
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+class HttpClient:
+    """
+    共有HTTPクライアントクラス
+    """
+    def __init__(self, connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE):
+        """
+        初期化メソッド
+
+        @param connect_timeout: 接続タイムアウト(秒)
+        @param read_timeout: 読み込みタイムアウト(秒)
+        @param pool_connections: プールを保持するホスト数
+        @param pool_maxsize: ホストごとに保持するコネクション数
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self._lock = threading.Lock()
+        self._counts = {'requests': 0, 'retries': 0, 'errors': 0}
+
+    def _count(self, key: str) -> None:
+        """
+        リクエスト統計のカウンタを加算する
+
+        @param key: 'requests', 'retries', 'errors'のいずれか
+        """
+        with self._lock:
+            self._counts[key] += 1
+
+    @staticmethod
+    def backoff(retry: int) -> float:
+        """
+        リトライ前の待機時間を返す(ジッター付き指数バックオフ)
+
+        @param retry: リトライ回数(0始まり)
+        @return: 待機時間(秒)
+        """
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+
+    def get(self, url: str, max_retry: int = MAX_RETRY_COUNT,
+            retry_status_codes: Iterable[int] = RETRY_STATUS_CODES) -> requests.Response:
+        """
+        GETリクエストを送りレスポンスを返す
+        接続エラー・タイムアウト・retry_status_codesのときはバックオフしてリトライ
+
+        @param url: URL
+        @param max_retry: 最大試行回数
+        @param retry_status_codes: リトライ対象のステータスコード
+        @return: レスポンス(最後の試行がエラーのときは例外を送出)
+        """
+        response = None
+        for retry in range(max_retry):
+            if retry > 0:
+                self._count('retries')
+                sleep(self.backoff(retry - 1))
+            self._count('requests')
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._count('errors')
+                if retry == max_retry - 1:
+                    raise
+                continue
+            if response.status_code not in retry_status_codes:
+                return response
+
+        return response
+
+    def pool_stats(self) -> dict:
+        """
+        コネクションプールの統計を返す
+        reusedはkeep-aliveで使い回されたリクエスト数
+
+        @return: e.g.) {'requests': 10, 'retries': 0, 'errors': 0,
+                        'pools': {'https://api.gnavi.co.jp': {'connections': 2, 'requests': 10, 'reused': 8}}}
+        """
+        pools = dict()
+        manager = self.adapter.poolmanager
+        for key in manager.pools.keys():
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            host = f'{key.key_scheme}://{key.key_host}'
+            stats = pools.setdefault(host, {'connections': 0, 'requests': 0, 'reused': 0})
+            stats['connections'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+            stats['reused'] += max(pool.num_requests - pool.num_connections, 0)
+
+        with self._lock:
+            stats = dict(self._counts)
+        stats['pools'] = pools
+
+        return stats
+
+
+_client: Optional[HttpClient] = None
+_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """
+    プロセス内で共有するHTTPクライアントを返す
+
+    @return: HttpClient
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = HttpClient()
+
+    return _client
@@ -0,0 +1,267 @@
+"""
+検索処理のステージごとの処理時間と累積カウンタを記録するモジュール
+リクエスト内のステージごとの処理時間はServerTimingMiddlewareがServer-Timingヘッダで返し、
+累積値はmetricsビューがテキスト形式(Prometheus形式)で公開する
+"""
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+from .consts import METRICS_ENABLED, METRICS_WINDOW
+from .http_client import get_client
+from .shop_cache import get_shop_cache
+from .singleflight import single_flight_stats
+
+from typing import Callable, Dict, Iterator, Optional
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 処理中のリクエストのステージ名 → 処理時間(ms)(ミドルウェアの外ではNone)
+_request_timings: contextvars.ContextVar = contextvars.ContextVar('request_timings', default=None)
+
+
+class StageHistogram:
+    """
+    ステージの処理時間の分布クラス
+    件数・合計は累積、分位点は直近window件から求める
+    """
+    def __init__(self, window: int = METRICS_WINDOW):
+        """
+        初期化メソッド
+
+        @param window: 分位点の計算に用いる直近の件数
+        """
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, seconds: float) -> None:
+        """
+        処理時間を追加する
+
+        @param seconds: 処理時間(秒)
+        """
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def quantiles(self) -> Dict[float, float]:
+        """
+        直近の処理時間の分位点を返す
+
+        @return: {0.5: 秒, 0.95: 秒, 0.99: 秒}
+        """
+        samples = sorted(self.samples)
+        if len(samples) == 0:
+            return {q: 0.0 for q in QUANTILES}
+
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    プロセス内のステージ別処理時間・カウンタの集計クラス
+    """
+    def __init__(self, window: int = METRICS_WINDOW):
+        """
+        初期化メソッド
+
+        @param window: 分位点の計算に用いる直近の件数
+        """
+        self.window = window
+        self.stages: Dict[str, StageHistogram] = dict()
+        self.counters: Dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        ステージの処理時間を記録する(リクエスト処理中であればServer-Timing用にも加算する)
+
+        @param stage: ステージ名
+        @param seconds: 処理時間(秒)
+        """
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram(self.window)
+            histogram.add(seconds)
+
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        カウンタを加算する
+
+        @param name: カウンタ名
+        @param n: 加算する値
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        """
+        現在の集計値を返す
+
+        @return: {'stages': {ステージ名: {'count', 'sum', 'quantiles'}}, 'counters': {カウンタ名: 値}}
+        """
+        with self._lock:
+            stages = {
+                stage: {'count': h.count, 'sum': h.sum, 'quantiles': h.quantiles()}
+                for stage, h in self.stages.items()
+            }
+            counters = dict(self.counters)
+
+        return {'stages': stages, 'counters': counters}
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    プロセス内で共有する集計を返す
+
+    @return: Metrics
+    """
+    return _metrics
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    withブロックの処理時間をステージの処理時間として記録する
+
+    @param name: ステージ名
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        _metrics.observe(name, perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """
+    関数の処理時間をステージの処理時間として記録するデコレータ
+
+    @param name: ステージ名
+    @return: デコレータ
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    カウンタを加算する
+
+    @param name: カウンタ名
+    @param n: 加算する値
+    """
+    if METRICS_ENABLED:
+        _metrics.count(name, n)
+
+
+def export_text(prefix: str = 'stopover_food') -> str:
+    """
+    累積カウンタ・ステージごとの処理時間の分位点をテキスト形式(Prometheus形式)で返す
+    ぐるなびAPI・店舗ページへのリクエスト数は共有HTTPクライアント、店舗データキャッシュのヒット数はShopCacheの統計を用いる
+
+    @param prefix: メトリクス名の接頭辞
+    @return: テキスト
+    """
+    snapshot = _metrics.snapshot()
+    counters = snapshot['counters']
+    client, shop_cache = get_client().pool_stats(), get_shop_cache().stats()
+    flights = single_flight_stats()
+    lines = list()
+
+    def metric(name: str, kind: str, help_text: str, samples: list) -> None:
+        lines.append(f'# HELP {prefix}_{name} {help_text}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for labels, value in samples:
+            label_text = '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}' if labels else ''
+            lines.append(f'{prefix}_{name}{label_text} {value}')
+
+    metric('requests_total', 'counter', 'Handled HTTP requests', [({}, counters.get('requests', 0))])
+    metric('upstream_requests_total', 'counter', 'Requests to Gurunavi API and shop pages', [
+        ({'client': 'sync'}, client['requests']), ({'client': 'async'}, counters.get('async_requests', 0))
+    ])
+    metric('upstream_retries_total', 'counter', 'Retried upstream requests', [
+        ({'client': 'sync'}, client['retries']), ({'client': 'async'}, counters.get('async_retries', 0))
+    ])
+    metric('upstream_errors_total', 'counter', 'Upstream connection errors and timeouts', [
+        ({'client': 'sync'}, client['errors']), ({'client': 'async'}, counters.get('async_errors', 0))
+    ])
+    metric('gurunavi_not_found_total', 'counter', 'Gurunavi API 404 responses (no shops)',
+           [({}, counters.get('gurunavi_404', 0))])
+    metric('query_plan_fallbacks_total', 'counter', 'Merged queries split per station (more hits than one page)',
+           [({}, counters.get('query_plan_fallbacks', 0))])
+    metric('cache_hits_total', 'counter', 'Cache hits', [
+        ({'cache': 'shop'}, shop_cache['hits']), ({'cache': 'image'}, counters.get('image_cache_hits', 0))
+    ])
+    metric('cache_misses_total', 'counter', 'Cache misses', [
+        ({'cache': 'shop'}, shop_cache['misses']), ({'cache': 'image'}, counters.get('image_cache_misses', 0))
+    ])
+    metric('shop_snapshot_stations_total', 'counter', 'Stations served from / missing in the prefetched shop snapshot', [
+        ({'result': 'hit'}, counters.get('shop_snapshot_hits', 0)),
+        ({'result': 'miss'}, counters.get('shop_snapshot_misses', 0)),
+    ])
+    metric('shop_snapshot_errors_total', 'counter', 'Failed shop snapshot reads',
+           [({}, counters.get('shop_snapshot_errors', 0))])
+    metric('single_flight_calls_total', 'counter', 'Calls executed vs coalesced into an in-flight call', [
+        ({'flight': name, 'result': result}, stats[result])
+        for name, stats in sorted(flights.items()) for result in ('executed', 'coalesced')
+    ])
+    metric('single_flight_errors_total', 'counter', 'Executed calls that raised (shared with every waiter)',
+           [({'flight': name}, stats['errors']) for name, stats in sorted(flights.items())])
+    metric('shop_cache_evictions_total', 'counter', 'Shop cache entries written by this process and gone before their TTL',
+           [({}, shop_cache['evictions'])])
+
+    samples = list()
+    for name, stats in sorted(snapshot['stages'].items()):
+        for q, value in stats['quantiles'].items():
+            samples.append(({'stage': name, 'quantile': q}, f'{value:.6f}'))
+    metric('stage_seconds', 'summary', 'Stage latency (quantiles over the most recent samples)', samples)
+    for name, stats in sorted(snapshot['stages'].items()):
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats["sum"]:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def begin_request() -> contextvars.Token:
+    """
+    リクエスト内のステージごとの処理時間の記録を開始する
+
+    @return: end_requestに渡すトークン
+    """
+    return _request_timings.set(dict())
+
+
+def end_request(token: contextvars.Token) -> Optional[Dict[str, float]]:
+    """
+    リクエスト内のステージごとの処理時間の記録を終了する
+
+    @param token: begin_requestが返したトークン
+    @return: ステージ名 → 処理時間(ms)
+    """
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+
+    return timings
@@ -0,0 +1,81 @@
+"""
+リクエスト内のステージごとの処理時間をServer-Timingヘッダで返すミドルウェアを配置するモジュール
+"""
+import asyncio
+from time import perf_counter
+
+from . import metrics
+from .consts import METRICS_ENABLED
+
+
+class ServerTimingMiddleware:
+    """
+    Server-Timingミドルウェア
+    e.g.) Server-Timing: station_load;dur=0.8, validation;dur=0.1, gurunavi;dur=412.3, ..., total;dur=530.2
+    (ストリーミングレスポンスはヘッダ送信時点で処理が終わっていないため付与しない)
+    """
+    # ASGIでは非同期のまま次のミドルウェアを呼び、リクエストごとにスレッドを占有しない
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """
+        初期化メソッド
+
+        @param get_response: 次のミドルウェアまたはビュー
+        """
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Djangoが非同期ミドルウェアとして扱うように、コルーチン関数とみなされるようにする
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not METRICS_ENABLED:
+            return self.get_response(request)
+
+        token = metrics.begin_request()
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+
+        return self._finish(response, timings, perf_counter() - start)
+
+    async def __acall__(self, request):
+        """
+        __call__の非同期版(ASGIで次のミドルウェアがコルーチン関数の場合)
+        """
+        if not METRICS_ENABLED:
+            return await self.get_response(request)
+
+        token = metrics.begin_request()
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+
+        return self._finish(response, timings, perf_counter() - start)
+
+    @staticmethod
+    def _finish(response, timings, total: float):
+        """
+        リクエスト全体の処理時間を記録し、ストリーミングでないレスポンスにServer-Timingヘッダを付与する
+
+        @param response: レスポンス
+        @param timings: ステージ名 → 処理時間(ms)
+        @param total: リクエスト全体の処理時間(秒)
+        @return: レスポンス
+        """
+        metrics.get_metrics().observe('request', total)
+        metrics.count('requests')
+
+        if not response.streaming:
+            entries = [f'{name};dur={ms:.1f}' for name, ms in timings.items()]
+            entries.append(f'total;dur={total * 1000:.1f}')
+            response['Server-Timing'] = ', '.join(entries)
+
+        return response
@@ -0,0 +1,168 @@
+"""
+緯度・経度から最寄り駅を引くための格子状の空間索引を配置するモジュール
+"""
+import math
+import numpy as np
+
+from .consts import NEAREST_CELL, NEAREST_MAX_DISTANCE, TRANSFER_MAX_DISTANCE
+from .distance import distances
+
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Tuple
+
+if TYPE_CHECKING:
+    from .station_index import Station
+
+METERS_PER_DEGREE = 111320  # 緯度1度あたりの距離(m)(格子の探索範囲の見積もり用)
+
+
+class NearbyStation(NamedTuple):
+    """
+    最寄り駅の検索結果
+    """
+    station_name: str
+    lines: Tuple[str, ...]  # 駅を通る路線名(駅順の若い路線から)
+    lat: float
+    lon: float
+    distance: float  # 検索地点からの距離(m)
+
+
+class NearestIndex:
+    """
+    最寄り駅索引クラス
+    駅の位置をNEAREST_CELL度四方の格子に振り分け、検索地点の格子から外側へ1周ずつ広げて探索する
+    (同じ駅名でTRANSFER_MAX_DISTANCE以内の駅は、路線をまとめた1駅として返す)
+    """
+    def __init__(self, stations: List['Station'], cell: float = NEAREST_CELL):
+        """
+        初期化メソッド
+
+        @param stations: 駅リスト
+        @param cell: 格子の間隔(度)
+        """
+        self.cell = cell
+        self.points: List[Tuple[str, float, float, List[str]]] = list()  # (駅名, 緯度, 経度, 路線名リスト)
+        self.grid: Dict[Tuple[int, int], List[int]] = dict()  # 格子 → 駅位置の番号リスト
+
+        positions = dict()
+        for station in stations:
+            key = (station.station_name, station.lat, station.lon)
+            if key not in positions:
+                positions[key] = len(self.points)
+                self.points.append((station.station_name, station.lat, station.lon, list()))
+                self.grid.setdefault(self._cell_of(station.lat, station.lon), list()).append(positions[key])
+            lines = self.points[positions[key]][3]
+            if station.line_name not in lines:
+                lines.append(station.line_name)
+
+        self.lats = np.array([point[1] for point in self.points], dtype=float)
+        self.lons = np.array([point[2] for point in self.points], dtype=float)
+
+    def _cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        """
+        緯度・経度が含まれる格子を返す
+
+        @param lat: 緯度
+        @param lon: 経度
+        @return: 格子の番号(緯度方向, 経度方向)
+        """
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def _ring(self, center: Tuple[int, int], r: int) -> List[int]:
+        """
+        中心の格子からr周目の格子に含まれる駅位置の番号を返す
+
+        @param center: 中心の格子
+        @param r: 周回数(0のとき中心の格子のみ)
+        @return: 駅位置の番号リスト
+        """
+        ci, cj = center
+        if r == 0:
+            return list(self.grid.get(center, ()))
+
+        found = list()
+        for j in range(cj - r, cj + r + 1):
+            found.extend(self.grid.get((ci - r, j), ()))
+            found.extend(self.grid.get((ci + r, j), ()))
+        for i in range(ci - r + 1, ci + r):
+            found.extend(self.grid.get((i, cj - r), ()))
+            found.extend(self.grid.get((i, cj + r), ()))
+
+        return found
+
+    def _merge(self, candidates: List[int], dists: np.ndarray, k: int) -> List[NearbyStation]:
+        """
+        候補を近い順に並べ、同じ駅名で乗換できる距離の駅を1駅にまとめる
+        (k駅目より乗換の距離以上遠い候補は結果に影響しないため見ない)
+
+        @param candidates: 駅位置の番号リスト
+        @param dists: 検索地点からの距離(m)
+        @param k: 駅数
+        @return: 最寄り駅のリスト(近い順、k駅以上の場合がある)
+        """
+        merged, by_name = list(), dict()  # 駅名 → merged内の位置リスト
+        for n in np.argsort(dists, kind='stable'):
+            if len(merged) >= k and dists[n] > merged[k - 1].distance + TRANSFER_MAX_DISTANCE:
+                break
+            name, lat, lon, lines = self.points[candidates[n]]
+            for i in by_name.get(name, ()):
+                nearby = merged[i]
+                if distances(nearby.lat, nearby.lon, lat, lon) <= TRANSFER_MAX_DISTANCE:
+                    merged[i] = nearby._replace(lines=nearby.lines + tuple(l for l in lines if l not in nearby.lines))
+                    break
+            else:
+                by_name.setdefault(name, list()).append(len(merged))
+                merged.append(NearbyStation(name, tuple(lines), lat, lon, float(dists[n])))
+
+        return merged
+
+    def nearest(self, lat: float, lon: float, k: int = 5,
+                max_distance: float = NEAREST_MAX_DISTANCE) -> List[NearbyStation]:
+        """
+        検索地点から近い順にk駅を返す
+
+        @param lat: 緯度
+        @param lon: 経度
+        @param k: 駅数
+        @param max_distance: 探索する距離の上限(m)、この範囲内にk駅無い場合は見つかった駅のみ返す
+        @return: 最寄り駅のリスト(近い順)
+        """
+        center = self._cell_of(lat, lon)
+        # r周目まで探索すれば、格子1辺の長さ(経度方向は緯度により短い) × r以内の駅は漏れなく含まれる
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + self.cell, 89.0))), 0.01)
+        cell_meters = self.cell * METERS_PER_DEGREE * cos_lat
+        max_ring = math.ceil(max_distance / cell_meters) + 1
+
+        # k駅見つかるまで1周ずつ広げる
+        candidates, merged, r = list(), list(), -1
+        while r < max_ring and len(merged) < k:
+            r += 1
+            candidates.extend(self._ring(center, r))
+            if len(candidates) >= k:
+                merged = self._merge(candidates, self._distances(lat, lon, candidates), k)
+        if len(candidates) == 0:
+            return list()
+        if len(candidates) < k:
+            # 探索範囲内の駅がk駅に満たない場合は、見つかった駅をまとめる
+            merged = self._merge(candidates, self._distances(lat, lon, candidates), k)
+
+        # k駅目の距離以内の駅と、その乗換駅(未探索の可能性がある)が含まれる周まで一度に広げる
+        needed = max_ring
+        if len(merged) >= k:
+            needed = min(max_ring, math.ceil((merged[k - 1].distance + TRANSFER_MAX_DISTANCE) / cell_meters))
+        if needed > r:
+            for ring in range(r + 1, needed + 1):
+                candidates.extend(self._ring(center, ring))
+            merged = self._merge(candidates, self._distances(lat, lon, candidates), k)
+
+        return [nearby for nearby in merged if nearby.distance <= max_distance][:k]
+
+    def _distances(self, lat: float, lon: float, candidates: List[int]) -> np.ndarray:
+        """
+        検索地点から候補の駅位置までの距離(m)を返す
+
+        @param lat: 緯度
+        @param lon: 経度
+        @param candidates: 駅位置の番号リスト
+        @return: 距離(m)の配列
+        """
+        return distances(lat, lon, self.lats[candidates], self.lons[candidates])
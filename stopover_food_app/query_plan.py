@@ -0,0 +1,114 @@
+"""
+区間内の駅の検索円の重なりを考慮して、ぐるなびAPIへの問い合わせ(中心・検索範囲)をまとめるモジュール
+"""
+import numpy as np
+
+from .distance import distances, distance_matrix
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+RANGE_METERS = {1: 300, 2: 500, 3: 1000, 4: 2000, 5: 3000}  # ぐるなびAPIの検索範囲 → 半径(m)
+MERGEABLE_RANGES = [range_ for range_ in RANGE_METERS if range_ + 1 in RANGE_METERS]  # 1段階広げて問い合わせられる検索範囲
+
+Cluster = Tuple[int, float, float]  # (グループ番号, 中心の緯度, 中心の経度)
+
+
+def cluster_line(points: Sequence[Tuple[float, float]], range_: int) -> List[Cluster]:
+    """
+    路線の駅を駅順にまとめたグループを作成する(路線ごとに1回だけ作成し、区間によらず同じグループを用いる)
+    駅順に、まとめた駅の重心から各駅までの距離が(1段階広い検索範囲の半径 - 元の半径)以内に収まる限り駅をまとめる
+    (このとき重心を中心とした広い検索円は、まとめた各駅の検索円をすべて含む)
+
+    @param points: 駅順の駅の(緯度, 経度)のリスト
+    @param range_: 駅ごとの検索範囲(MERGEABLE_RANGESのいずれか)
+    @return: 駅ごとの所属グループ(pointsと同じ順)
+    """
+    margin = RANGE_METERS[range_ + 1] - RANGE_METERS[range_]
+    groups, group = list(), list()
+    for point in points:
+        candidate = group + [point]
+        center = _centroid(candidate)
+        dists = distances(center[0], center[1], [lat for lat, _ in candidate], [lon for _, lon in candidate])
+        if (dists <= margin).all():
+            group = candidate
+            continue
+        groups.append(group)
+        group = [point]
+    if group:
+        groups.append(group)
+
+    clusters = list()
+    for number, group in enumerate(groups):
+        center = _centroid(group)
+        clusters.extend([(number, center[0], center[1])] * len(group))
+
+    return clusters
+
+
+def plan_queries(station_list: list, range_: int, clusters: Sequence[Optional[Tuple]]) -> List[dict]:
+    """
+    区間内の駅のうち同じグループの駅を1回の問い合わせにまとめる問い合わせ計画を作成する
+    まとめた問い合わせはグループの重心を中心に1段階広い検索範囲で問い合わせる
+    (中心は路線ごとに固定のため、乗車駅・降車駅が異なる検索でも同じ問い合わせになり、キャッシュを共有できる)
+
+    @param station_list: 駅の(経度, 緯度, 駅名)のリスト(乗車駅 → 降車駅順)
+    @param range_: 駅ごとの検索範囲(1: 300m, 2: 500m, 3: 1000m, 4: 2000m, 5: 3000m)
+    @param clusters: 駅ごとの所属グループ(路線名, グループ番号, 中心の緯度, 中心の経度)、Noneの駅はまとめない
+    @return: [{'lat': 緯度, 'lng': 経度, 'range': 検索範囲, 'merged': まとめたか否か,
+               'stations': [(経度, 緯度, 駅名), ...]}, ...](最初の駅の順)
+    """
+    groups: Dict[Tuple, list] = dict()
+    for position, (station, cluster) in enumerate(zip(station_list, clusters)):
+        key = cluster[:2] if cluster is not None else position
+        groups.setdefault(key, [cluster, list()])[1].append(station)
+
+    plans = list()
+    for cluster, stations in groups.values():
+        if len(stations) == 1:
+            lon, lat, _ = stations[0]
+            plans.append({'lat': lat, 'lng': lon, 'range': range_, 'merged': False, 'stations': stations})
+        else:
+            plans.append({'lat': cluster[2], 'lng': cluster[3], 'range': range_ + 1, 'merged': True,
+                          'stations': stations})
+
+    return plans
+
+
+def _centroid(points: list) -> tuple:
+    """
+    駅の緯度・経度の重心を返す(区間内の距離程度であれば平面とみなしてよい)
+
+    @param points: 駅の(緯度, 経度)のリスト
+    @return: (緯度, 経度)
+    """
+    return (sum(lat for lat, _ in points) / len(points),
+            sum(lon for _, lon in points) / len(points))
+
+
+def assign_stations(shop_datas: List[list], plan: dict, range_: int) -> List[list]:
+    """
+    まとめた問い合わせの結果を、店舗から検索範囲内にある駅ごとの飲食店データに振り分ける
+    (駅ごとに問い合わせた場合と同じく、駅順に、各駅の検索範囲内の店舗を1行ずつ返す)
+
+    @param shop_datas: ぐるなびAPIの飲食店データリスト(15. 緯度, 16. 経度を含む)
+    @param plan: 問い合わせ計画
+    @param range_: 駅ごとの検索範囲
+    @return: 駅名・距離を振り分けた駅のものにした飲食店データリスト
+    """
+    assigned = list()
+    if len(shop_datas) == 0:
+        return assigned
+
+    # 駅 × 店舗の距離行列をまとめて計算
+    radius = RANGE_METERS[range_]
+    matrix = distance_matrix(
+        [lat for _, lat, _ in plan['stations']], [lon for lon, _, _ in plan['stations']],
+        [shop_data[15] for shop_data in shop_datas], [shop_data[16] for shop_data in shop_datas]
+    )
+    for (_, _, name), dists in zip(plan['stations'], matrix):
+        for n in np.argsort(dists, kind='stable'):
+            if dists[n] > radius:
+                break
+            assigned.append(shop_datas[n][:12] + [name + '駅', float(dists[n])] + shop_datas[n][14:])
+
+    return assigned
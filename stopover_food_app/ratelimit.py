@@ -0,0 +1,124 @@
+"""
+スクレイピング先ホストごとのリクエスト間隔をプロセス全体で制御するトークンバケットを配置するモジュール
+"""
+import threading
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+from .consts import SCRAPE_RATE, SCRAPE_BURST
+
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """
+    トークンバケットクラス
+    1秒あたりrate個のトークンが最大capacity個まで溜まり、1リクエストごとに1個消費する
+    """
+    def __init__(self, rate: float, capacity: float):
+        """
+        初期化メソッド
+
+        @param rate: 1秒あたりに補充するトークン数
+        @param capacity: 溜められるトークンの最大数(バースト数)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        トークンを1個取得する(足りない場合は補充されるまで待機する)
+
+        @return: 待機した時間(秒)
+        """
+        wait = self.reserve()
+        if wait > 0:
+            sleep(wait)
+
+        return wait
+
+    def reserve(self) -> float:
+        """
+        トークンを1個予約し、使えるようになるまでの待機時間を返す(待機は呼び出し側で行う)
+
+        @return: 待機すべき時間(秒)
+        """
+        with self._lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 先にトークンを消費しておき、不足分は待機時間として各スレッドに割り当てる
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class HostRateLimiter:
+    """
+    ホストごとのトークンバケットを管理するクラス
+    """
+    def __init__(self, rate: float = SCRAPE_RATE, capacity: float = SCRAPE_BURST):
+        """
+        初期化メソッド
+
+        @param rate: ホストごとの1秒あたりのリクエスト数
+        @param capacity: ホストごとのバースト数
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, url: str) -> TokenBucket:
+        """
+        URLのホストのトークンバケットを返す
+
+        @param url: リクエスト先のURL
+        @return: TokenBucket
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.capacity)
+
+        return bucket
+
+    def acquire(self, url: str) -> float:
+        """
+        URLのホストに対するリクエスト許可を得る
+
+        @param url: リクエスト先のURL
+        @return: 待機した時間(秒)
+        """
+        return self._bucket(url).acquire()
+
+    def reserve(self, url: str) -> float:
+        """
+        URLのホストに対するリクエスト許可を予約し、待機すべき時間を返す(非同期処理用)
+
+        @param url: リクエスト先のURL
+        @return: 待機すべき時間(秒)
+        """
+        return self._bucket(url).reserve()
+
+
+_rate_limiter: Optional[HostRateLimiter] = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter() -> HostRateLimiter:
+    """
+    プロセス内で共有するホスト別レートリミッタを返す
+
+    @return: HostRateLimiter
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _lock:
+            if _rate_limiter is None:
+                _rate_limiter = HostRateLimiter()
+
+    return _rate_limiter
@@ -0,0 +1,112 @@
+"""
+路線をまたいだ経路(乗換あり)を求めるための駅グラフを配置するモジュール
+"""
+import heapq
+
+from .consts import TRANSFER_MAX_DISTANCE, TRANSFER_PENALTY
+from .distance import distances
+
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .station_index import Station, LineTopology
+
+
+class RouteGraph:
+    """
+    駅グラフクラス
+    路線内の隣り合う駅(環状線は終点 → 始点も)を駅間距離で結び、
+    駅名が同じで距離がTRANSFER_MAX_DISTANCE以内の他路線の駅を乗換(駅間距離 + TRANSFER_PENALTY)で結ぶ
+    (station_infoには駅グループコードが無いため、駅名と位置で乗換駅を判定する)
+    """
+    def __init__(self, topologies: Dict[str, 'LineTopology']):
+        """
+        初期化メソッド
+
+        @param topologies: 路線名 → 駅の並び
+        """
+        self.nodes: List['Station'] = list()
+        self.by_name: Dict[str, List[int]] = dict()  # 駅名 → ノード番号リスト
+        self.edges: List[List[Tuple[int, float]]] = list()  # ノード番号 → [(隣接ノード番号, 重み), ...]
+
+        for topology in topologies.values():
+            first = len(self.nodes)
+            for station in topology.stations:
+                self.by_name.setdefault(station.station_name, list()).append(len(self.nodes))
+                self.nodes.append(station)
+                self.edges.append(list())
+            last = len(self.nodes) - 1
+            for node in range(first, last):
+                self._link(node, node + 1, 0.0)
+            if topology.is_loop and last - first >= 2:
+                self._link(last, first, 0.0)
+
+        for nodes in self.by_name.values():
+            for i, a in enumerate(nodes):
+                for b in nodes[i + 1:]:
+                    if self.nodes[a].line_name == self.nodes[b].line_name:
+                        continue
+                    if self._distance(a, b) <= TRANSFER_MAX_DISTANCE:
+                        self._link(a, b, TRANSFER_PENALTY)
+
+    def _distance(self, a: int, b: int) -> float:
+        """
+        ノード間の距離(m)を返す
+
+        @param a: ノード番号
+        @param b: ノード番号
+        @return: 距離(m)
+        """
+        return float(distances(self.nodes[a].lat, self.nodes[a].lon, self.nodes[b].lat, self.nodes[b].lon))
+
+    def _link(self, a: int, b: int, penalty: float) -> None:
+        """
+        ノード間を双方向に結ぶ
+
+        @param a: ノード番号
+        @param b: ノード番号
+        @param penalty: 駅間距離に加える重み
+        """
+        weight = self._distance(a, b) + penalty
+        self.edges[a].append((b, weight))
+        self.edges[b].append((a, weight))
+
+    def has_station(self, station: str) -> bool:
+        """
+        駅名がいずれかの路線に存在するかを返す
+
+        @param station: 駅名
+        @return: 存在するか否かのbool値
+        """
+        return station in self.by_name
+
+    def shortest_path(self, start: str, end: str) -> Optional[List['Station']]:
+        """
+        乗車駅から降車駅までの最短経路をダイクストラ法で求める(乗車駅・降車駅はどの路線の駅でもよい)
+
+        @param start: 乗車駅名
+        @param end: 降車駅名
+        @return: 経路上の駅リスト(乗換駅は路線ごとに含む)、経路が無い場合はNone
+        """
+        targets = set(self.by_name.get(end, list()))
+        dist = {node: 0.0 for node in self.by_name.get(start, list())}
+        prev = dict()
+        heap = [(0.0, node) for node in dist]
+        heapq.heapify(heap)
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            if node in targets:
+                path = [node]
+                while path[-1] in prev:
+                    path.append(prev[path[-1]])
+                return [self.nodes[n] for n in reversed(path)]
+            for neighbor, weight in self.edges[node]:
+                nd = d + weight
+                if nd < dist.get(neighbor, float('inf')):
+                    dist[neighbor] = nd
+                    prev[neighbor] = node
+                    heapq.heappush(heap, (nd, neighbor))
+
+        return None
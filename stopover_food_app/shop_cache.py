@@ -0,0 +1,164 @@
+"""
+ぐるなびAPIの検索結果(フィルタ済みの店舗データ)をDjangoのキャッシュフレームワークに保存するモジュール
+キャッシュのバックエンドはsettings.CACHESの'gurunavi'で切り替える(開発: ローカルメモリ, 本番: ファイル・memcached等)
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+from django.core.cache import caches
+
+from .consts import SHOP_CACHE_ALIAS, SHOP_CACHE_TTL, SHOP_CACHE_TRACKED_KEYS
+from .singleflight import get_single_flight
+
+from typing import Callable, List, Optional
+
+CACHE_VERSION = 4  # 店舗データの形式を変えたときに上げる
+
+
+class ShopCache:
+    """
+    店舗データキャッシュクラス
+    (lat, lng, range, keyword)をキーに、TTL付きで保存する
+    (複数駅をまとめた問い合わせ(params['merged'])は、guruanvi.merged_guruanvi_apiの結果の辞書を保存する)
+    (件数上限はバックエンドのMAX_ENTRIES・CULL_FREQUENCYに任せる。プロセスごとに追い出すと、
+    ファイル・memcached等の共有バックエンドで他のワーカーがよく使うキーまで消してしまうため)
+    追い出しはバックエンドから件数を取れないため、このプロセスが保存したキーが有効期間内にミスした件数で数える
+    """
+    def __init__(self, alias: str = SHOP_CACHE_ALIAS, ttl: int = SHOP_CACHE_TTL):
+        """
+        初期化メソッド
+
+        @param alias: settings.CACHESのキャッシュ名
+        @param ttl: 有効期間(秒)
+        """
+        self.alias = alias
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # このプロセスが保存したキー → 有効期限(追い出しを数えるためだけに保持し、古いものから忘れる)
+        self._written: OrderedDict = OrderedDict()
+
+    @property
+    def cache(self):
+        """
+        キャッシュバックエンド
+        """
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        """
+        検索パラメータからキャッシュキーを作成する(memcachedでも使えるようASCIIのハッシュ値にする)
+
+        @param params: パラメータ辞書 e.g.) {"lat": 35.409, "lng": 139.596, "range": 3, 'keyword': 'ラーメン', ...}
+        @return: キャッシュキー
+        """
+        raw = f"{float(params['lat']):.6f}:{float(params['lng']):.6f}:{params['range']}:{params['keyword']}"
+        if params.get('merged'):
+            raw += ':merged'  # 複数駅をまとめた問い合わせは保存する形式が異なる
+
+        return f'gurunavi:shops:{CACHE_VERSION}:' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _count(self, key: str) -> None:
+        """
+        統計カウンタを加算する
+
+        @param key: 'hits', 'misses', 'evictions'のいずれか
+        """
+        with self._lock:
+            self._stats[key] += 1
+
+    def get(self, params: dict) -> Optional[List[list]]:
+        """
+        キャッシュ済みの店舗データを返す
+
+        @param params: パラメータ辞書
+        @return: 店舗データリスト(キャッシュに無ければNone)
+        """
+        key = self.make_key(params)
+        shop_datas = self.cache.get(key)
+        if shop_datas is None:
+            with self._lock:
+                self._stats['misses'] += 1
+                # 有効期間内に無くなっている = バックエンドの件数上限・メモリ不足で追い出された
+                if self._written.pop(key, 0) > time():
+                    self._stats['evictions'] += 1
+            return None
+
+        self._count('hits')
+        return shop_datas
+
+    def set(self, params: dict, shop_datas: List[list]) -> None:
+        """
+        店舗データをキャッシュに保存する
+
+        @param params: パラメータ辞書
+        @param shop_datas: 店舗データリスト
+        """
+        key = self.make_key(params)
+        self.cache.set(key, shop_datas, self.ttl)
+        with self._lock:
+            self._written[key] = time() + self.ttl
+            self._written.move_to_end(key)
+            if len(self._written) > SHOP_CACHE_TRACKED_KEYS:
+                self._written.popitem(last=False)
+
+    def get_or_fetch(self, params: dict, fetch: Callable[[dict], List[list]]) -> List[list]:
+        """
+        キャッシュに無ければfetchで取得して保存し、店舗データを返す
+        同じキーの取得が他のスレッドで実行中の場合は、fetchを呼ばずにその結果を待つ
+
+        @param params: パラメータ辞書
+        @param fetch: 店舗データを取得する関数 e.g.) guruanvi.guruanvi_api
+        @return: 店舗データリスト
+        """
+        shop_datas = self.get(params)
+        if shop_datas is None:
+            shop_datas = get_single_flight('gurunavi').do(self.make_key(params), self.fetch_and_set, params, fetch)
+
+        return shop_datas
+
+    def fetch_and_set(self, params: dict, fetch: Callable[[dict], List[list]]) -> List[list]:
+        """
+        fetchで取得した店舗データを保存して返す
+        (直前に他の処理が保存していればfetchを呼ばずにそれを返す)
+
+        @param params: パラメータ辞書
+        @param fetch: 店舗データを取得する関数
+        @return: 店舗データリスト
+        """
+        shop_datas = self.cache.get(self.make_key(params))
+        if shop_datas is None:
+            shop_datas = fetch(params)
+            self.set(params, shop_datas)
+
+        return shop_datas
+
+    def stats(self) -> dict:
+        """
+        ヒット・ミス・追い出し件数を返す
+
+        @return: e.g.) {'hits': 10, 'misses': 3, 'evictions': 1}
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+_shop_cache: Optional[ShopCache] = None
+_lock = threading.Lock()
+
+
+def get_shop_cache() -> ShopCache:
+    """
+    プロセス内で共有する店舗データキャッシュを返す
+
+    @return: ShopCache
+    """
+    global _shop_cache
+    if _shop_cache is None:
+        with _lock:
+            if _shop_cache is None:
+                _shop_cache = ShopCache()
+
+    return _shop_cache
@@ -0,0 +1,126 @@
+"""
+駅・カテゴリーごとに事前取得した店舗データ(shop_snapshotテーブル)を読み書きする関数を配置するモジュール
+書き込みはdeploy_station/prefetch.py、読み込みは下車飯クラスが行う
+"""
+import threading
+import psycopg2
+from psycopg2.extras import execute_values, Json
+from psycopg2.pool import ThreadedConnectionPool
+
+from .consts import (
+    DATABASE, SHOP_SNAPSHOT_TABLE, SHOP_SNAPSHOT_MAX_AGE, SHOP_SNAPSHOT_POOL_MINSIZE, SHOP_SNAPSHOT_POOL_MAXSIZE
+)
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {SHOP_SNAPSHOT_TABLE} (
+    station_cd integer NOT NULL,
+    category varchar(32) NOT NULL,
+    search_range integer NOT NULL,
+    shops jsonb NOT NULL,
+    fetched_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (station_cd, category, search_range)
+);
+"""
+
+_pool: Optional[ThreadedConnectionPool] = None
+_lock = threading.Lock()
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """
+    プロセス内で共有する店舗データ読み込み用のDBコネクションプールを返す
+    (SHOP_SNAPSHOT_POOL_MINSIZE本は接続したまま保持し、検索のたびに接続し直さない)
+
+    @return: ThreadedConnectionPool
+    """
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(SHOP_SNAPSHOT_POOL_MINSIZE, SHOP_SNAPSHOT_POOL_MAXSIZE, **DATABASE)
+
+    return _pool
+
+
+def create_table(conn) -> None:
+    """
+    店舗データのテーブルが無ければ作成する
+
+    @param conn: DBコネクション
+    """
+    with conn.cursor() as cur:
+        cur.execute(CREATE_TABLE_SQL)
+
+
+def fresh_station_cds(conn, category: str, range_: int, max_age: int = SHOP_SNAPSHOT_MAX_AGE) -> Set[int]:
+    """
+    取得からmax_age秒以内の店舗データがある駅の駅コードを返す
+
+    @param conn: DBコネクション
+    @param category: カテゴリー(CATEGORY_DICTのキー) e.g.) 'ra-men'
+    @param range_: 検索範囲
+    @param max_age: 有効期間(秒)
+    @return: 駅コードの集合
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT station_cd FROM {SHOP_SNAPSHOT_TABLE} "
+            "WHERE category = %s AND search_range = %s AND fetched_at > now() - %s * interval '1 second';",
+            (category, range_, max_age)
+        )
+        return {row[0] for row in cur.fetchall()}
+
+
+def save_snapshots(conn, records: Iterable[Tuple[int, str, int, List[list]]]) -> None:
+    """
+    駅ごとの店舗データを保存する(既にある駅は上書きして取得日時を更新する)
+
+    @param conn: DBコネクション
+    @param records: [(駅コード, カテゴリー, 検索範囲, 飲食店データリスト), ...]
+    """
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"INSERT INTO {SHOP_SNAPSHOT_TABLE} (station_cd, category, search_range, shops) VALUES %s "
+            "ON CONFLICT (station_cd, category, search_range) "
+            "DO UPDATE SET shops = EXCLUDED.shops, fetched_at = now();",
+            [(station_cd, category, range_, Json(shops)) for station_cd, category, range_, shops in records]
+        )
+
+
+def load_snapshots(station_cds: List[int], category: str, range_: int,
+                   max_age: int = SHOP_SNAPSHOT_MAX_AGE) -> Dict[int, List[list]]:
+    """
+    駅ごとの事前取得した店舗データを1回の問い合わせで読み込む(取得からmax_age秒を過ぎたものは除く)
+
+    @param station_cds: 駅コードのリスト
+    @param category: カテゴリー(CATEGORY_DICTのキー)
+    @param range_: 検索範囲
+    @param max_age: 有効期間(秒)
+    @return: 駅コード → 飲食店データリスト(guruanvi_apiと同じ形式)
+    """
+    if len(station_cds) == 0:
+        return dict()
+
+    # 同時に用いるコネクションが上限に達している場合はPoolError(psycopg2.Errorのサブクラス)を送出する
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT station_cd, shops FROM {SHOP_SNAPSHOT_TABLE} "
+                "WHERE station_cd = ANY(%s) AND category = %s AND search_range = %s "
+                "AND fetched_at > now() - %s * interval '1 second';",
+                (list(station_cds), category, range_, max_age)
+            )
+            return {station_cd: shops for station_cd, shops in cur.fetchall()}
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # 切断されたコネクションはプールに戻さずに閉じる
+        pool.putconn(conn, close=True)
+        conn = None
+        raise
+    finally:
+        if conn is not None:
+            pool.putconn(conn)  # 読み込み中のトランザクションはプールがロールバックする
@@ -0,0 +1,172 @@
+"""
+同じキーの処理が同時に要求された場合に1回だけ実行し、結果(例外)を待っている全員で共有する仕組みを配置するモジュール
+(キャッシュが空の状態で同じ検索・ぐるなびAPIへの問い合わせが集中したときの重複を防ぐ)
+"""
+import asyncio
+import threading
+import weakref
+from functools import partial
+
+from .consts import SINGLE_FLIGHT_ENABLED
+
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    """
+    実行中の処理(同期版)
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    シングルフライトクラス
+    同期版(do)はスレッド間、非同期版(do_async)は同じイベントループ内のタスク間で処理をまとめる
+    """
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        """
+        初期化メソッド
+
+        @param enabled: Falseのとき処理をまとめずにそのまま実行する
+        """
+        self.enabled = enabled
+        self._calls: Dict[Hashable, _Call] = dict()
+        # asyncio.Futureは作成したイベントループでしか待てないため、ループごとに保持する
+        self._futures = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'coalesced': 0, 'errors': 0}
+
+    def _count(self, key: str) -> None:
+        """
+        統計カウンタを加算する
+
+        @param key: 'executed', 'coalesced', 'errors'のいずれか
+        """
+        with self._lock:
+            self._stats[key] += 1
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        keyの処理が実行中であればその終了を待って結果を返し、無ければfuncを実行して結果を返す
+        (funcが例外を送出した場合は、待っていた全員に同じ例外を送出する)
+
+        @param key: 処理をまとめるキー
+        @param func: 実行する関数
+        @return: funcの戻り値(待っていた場合は実行した側と同じオブジェクト)
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._stats['executed' if leader else 'coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as ex:
+            call.error = ex
+            self._count('errors')
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    async def do_async(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        doの非同期版(同じイベントループ内で実行中の処理をまとめる)
+
+        @param key: 処理をまとめるキー
+        @param func: 実行するコルーチン関数
+        @return: funcの戻り値
+        """
+        if not self.enabled:
+            return await func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            futures = self._futures.get(loop)
+            if futures is None:
+                futures = self._futures[loop] = dict()
+            task = futures.get(key)
+            leader = task is None
+            if leader:
+                # 共有する処理は別タスクで実行し、最初に要求した側がキャンセルされても待っている側に影響させない
+                task = futures[key] = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(partial(self._done_async, futures, key))
+            self._stats['executed' if leader else 'coalesced'] += 1
+
+        # 呼び出した側(最初に要求した側を含む)がキャンセルされても、実行中の処理は止めない
+        return await asyncio.shield(task)
+
+    def _done_async(self, futures: dict, key: Hashable, task: asyncio.Future) -> None:
+        """
+        do_asyncで共有した処理の終了時に、実行中の処理から外して例外を数える
+
+        @param futures: 実行中の処理(イベントループごと)
+        @param key: 処理をまとめるキー
+        @param task: 終了したタスク
+        """
+        with self._lock:
+            if futures.get(key) is task:
+                del futures[key]
+        # 待っている側が全員キャンセルされた場合に未取得の例外として警告されないよう、ここで取得する
+        if not task.cancelled() and task.exception() is not None:
+            self._count('errors')
+
+    def stats(self) -> dict:
+        """
+        実行した件数・まとめた(実行中の処理を待った)件数・例外の件数を返す
+
+        @return: e.g.) {'executed': 10, 'coalesced': 32, 'errors': 0}
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+_single_flights: Dict[str, SingleFlight] = dict()
+_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    プロセス内で共有するシングルフライトを返す(処理の種類ごとに分ける)
+
+    @param name: 処理の種類 e.g.) 'search', 'gurunavi'
+    @return: SingleFlight
+    """
+    single_flight = _single_flights.get(name)
+    if single_flight is None:
+        with _lock:
+            single_flight = _single_flights.setdefault(name, SingleFlight())
+
+    return single_flight
+
+
+def single_flight_stats() -> Dict[str, dict]:
+    """
+    処理の種類ごとの統計を返す
+
+    @return: e.g.) {'search': {'executed': 3, 'coalesced': 12, 'errors': 0}, 'gurunavi': {...}}
+    """
+    with _lock:
+        single_flights = dict(_single_flights)
+
+    return {name: single_flight.stats() for name, single_flight in single_flights.items()}
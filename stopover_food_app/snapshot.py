@@ -0,0 +1,75 @@
+"""
+検索結果(重複削除済みの飲食店情報リスト)を短期間保存し、ページ送り時に再計算せずに返すためのモジュール
+保存先はsettings.CACHESの'snapshot'(2ページ目以降は別のワーカーに届くため、複数ワーカーでは共有バックエンドにする)
+"""
+import json
+import hashlib
+import secrets
+from django.core.cache import caches
+
+from .consts import SNAPSHOT_CACHE_ALIAS, SNAPSHOT_TTL
+
+from typing import Optional
+
+
+def save_snapshot(query: tuple, data: list, progress: Optional[dict] = None, token: Optional[str] = None,
+                  etag: Optional[str] = None) -> str:
+    """
+    検索結果を保存してスナップショットキーを返す
+
+    @param query: 検索条件 e.g.) ('東急東横線', '横浜', '自由が丘', 'ra-men')
+    @param data: 飲食店情報の辞書のリスト
+    @param progress: 途中まで検索した場合の途中経過(StopoverFood.stopover_food_lazy参照)、全駅検索済みの場合はNone
+    @param token: 既存のスナップショットを更新する場合のスナップショットキー
+    @param etag: 計算済みの検索結果のハッシュ値(Noneの場合は計算する)
+    @return: スナップショットキー
+    """
+    if token is None:
+        token = secrets.token_urlsafe(12)
+    if etag is None:
+        etag = digest(data)
+    snapshot = {'query': query, 'data': data, 'progress': progress, 'etag': etag}
+    caches[SNAPSHOT_CACHE_ALIAS].set(f'snapshot:{token}', snapshot, SNAPSHOT_TTL)
+
+    return token
+
+
+def load_snapshot(token: str, query: tuple) -> Optional[dict]:
+    """
+    スナップショットキーに対応する検索結果を返す
+
+    @param token: スナップショットキー
+    @param query: 検索条件(保存時と異なる場合は無効)
+    @return: {'data': 飲食店情報の辞書のリスト, 'progress': 途中経過, 'etag': 検索結果のハッシュ値}
+        (期限切れ・存在しない場合はNone)
+    """
+    if not token:
+        return None
+
+    snapshot = caches[SNAPSHOT_CACHE_ALIAS].get(f'snapshot:{token}')
+    if snapshot is None or snapshot['query'] != query:
+        return None
+
+    return snapshot
+
+
+def digest(data: list) -> str:
+    """
+    検索結果のハッシュ値を返す(保存時に1回だけ計算し、ページごとのETagの元にする)
+
+    @param data: 飲食店情報の辞書のリスト
+    @return: ハッシュ値(16進数)
+    """
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def is_complete(progress: Optional[dict]) -> bool:
+    """
+    区間内の全駅を検索済みかどうかを返す
+
+    @param progress: 途中経過
+    @return: 全駅検索済みか否かのbool値
+    """
+    return progress is None or progress['cursor'] >= progress['total']
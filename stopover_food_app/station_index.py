@@ -0,0 +1,326 @@
+"""
+駅情報テーブル(station_info)をプロセス内に一度だけ読み込み、路線名・(路線名, 駅名)をキーに引ける索引を配置するモジュール
+"""
+import threading
+from time import monotonic
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from .consts import DATABASE, LOOP_GAP_FACTOR, STATION_INDEX_CHECK_INTERVAL
+from .fuzzy_index import FuzzyIndex
+from .route_graph import RouteGraph
+from .nearest_index import NearestIndex
+from .distance import distances
+from .query_plan import MERGEABLE_RANGES, Cluster, cluster_line
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# station_infoの内容が変わると変わる値(行数, 全行のハッシュ値)
+VERSION_SQL = (
+    "SELECT count(*), md5(string_agg(concat_ws(':', index, line_cd, station_cd, line_name, station_name, lat, lon), "
+    "',' ORDER BY station_cd, line_cd)) FROM station_info;"
+)
+
+
+class Station(NamedTuple):
+    """
+    駅情報レコード
+    """
+    order: int  # station_infoのindex(路線内の駅順)
+    line_cd: int
+    station_cd: int
+    line_name: str
+    line_name_roman: str
+    station_name: str
+    station_name_roman: str
+    lat: float
+    lon: float
+
+
+class LineTopology(NamedTuple):
+    """
+    路線の駅の並び
+    """
+    stations: Tuple[Station, ...]  # 駅順の駅(環状線で始点駅を終点にも持つデータの場合は重複を除く)
+    positions: Dict[str, int]  # 駅名 → stations内の位置
+    is_loop: bool  # 環状線か否か
+    clusters: Dict[int, Dict[str, Cluster]]  # 検索範囲 → 駅名 → ぐるなびAPIへの問い合わせをまとめるグループ(cluster_ofで作成)
+
+    @classmethod
+    def build(cls, stations: List[Station]) -> 'LineTopology':
+        """
+        駅順の駅リストから路線の駅の並びを作成する
+        始点駅と終点駅が同じ駅名の場合、または始点・終点の駅間距離が路線内の隣り合う駅間距離の中央値の
+        LOOP_GAP_FACTOR倍以内で、かつ始点・終点の駅が互いに(隣の駅を除いて)最も近い駅の場合に環状線とみなす
+        (直線の路線や、支線の駅を続けて持つ路線の終点が始点の近くにあるだけの場合は環状線としない)
+
+        @param stations: 駅順の駅リスト
+        @return: LineTopology
+        """
+        is_loop = False
+        if len(stations) >= 3 and stations[0].station_name == stations[-1].station_name:
+            stations, is_loop = stations[:-1], True
+        elif len(stations) >= 4:
+            lats = np.array([s.lat for s in stations], dtype=float)
+            lons = np.array([s.lon for s in stations], dtype=float)
+            gaps = distances(lats[:-1], lons[:-1], lats[1:], lons[1:])
+            closing = distances(lats[0], lons[0], lats[-1], lons[-1])
+            # 始点から終点が、終点から始点が、それぞれ隣の駅以外のどの駅よりも近いこと
+            adjacent = (closing < distances(lats[0], lons[0], lats[2:-1], lons[2:-1]).min()
+                        and closing < distances(lats[-1], lons[-1], lats[1:-2], lons[1:-2]).min())
+            is_loop = bool(adjacent and closing <= np.median(gaps) * LOOP_GAP_FACTOR)
+
+        positions = dict()
+        for position, station in enumerate(stations):
+            positions.setdefault(station.station_name, position)
+
+        return cls(tuple(stations), positions, is_loop, dict())
+
+    def cluster_of(self, station_name: str, range_: int) -> Optional[Cluster]:
+        """
+        ぐるなびAPIへの問い合わせをまとめる、駅の所属グループを返す
+        区間によらず同じ問い合わせになるよう、路線全体を検索範囲ごとに1回だけまとめる(初回の検索時に作成する)
+
+        @param station_name: 駅名
+        @param range_: 駅ごとの検索範囲
+        @return: (グループ番号, 中心の緯度, 中心の経度)(まとめられない検索範囲の場合はNone)
+        """
+        if range_ not in MERGEABLE_RANGES:
+            return None
+
+        clusters = self.clusters.get(range_)
+        if clusters is None:
+            # 同時に作成しても結果は同じため、ロックは取らない
+            clusters = dict()
+            for station, cluster in zip(self.stations, cluster_line([(s.lat, s.lon) for s in self.stations], range_)):
+                clusters.setdefault(station.station_name, cluster)
+            self.clusters[range_] = clusters
+
+        return clusters.get(station_name)
+
+    def section(self, start: str, end: str) -> List[Station]:
+        """
+        乗車駅から降車駅までの区間の駅を乗車駅 → 降車駅順に返す
+        環状線の場合は駅数の少ない回り方を選ぶ(同数の場合は始点・終点をまたぐ回り方)
+
+        @param start: 乗車駅名
+        @param end: 降車駅名
+        @return: 駅リスト
+        """
+        i, j = self.positions[start], self.positions[end]
+        st = self.stations
+        if not self.is_loop or abs(j - i) < len(st) - abs(j - i):
+            return list(st[i:j + 1]) if i <= j else list(st[j:i + 1][::-1])
+
+        # 始点・終点をまたぐ回り方
+        return list(st[:i + 1][::-1] + st[j:][::-1]) if i < j else list(st[i:] + st[:j + 1])
+
+
+class StationIndex:
+    """
+    駅情報索引クラス
+    """
+    def __init__(self, df: pd.DataFrame, version: Optional[tuple] = None):
+        """
+        初期化メソッド
+
+        @param df: station_infoのデータフレーム
+        @param version: 読み込んだ時点のstation_infoのバージョン(DBから読み込んだ場合のみ)
+        """
+        self.version = version
+        self.lines: Dict[str, List[Station]] = dict()  # 路線名 → 駅順にソート済みの駅リスト
+        self.stations: Dict[Tuple[str, str], Station] = dict()  # (路線名, 駅名) → 駅
+        self.line_romans: Dict[str, str] = dict()  # 路線名 → 路線名(ローマ字)
+        self.topologies: Dict[str, LineTopology] = dict()  # 路線名 → 駅の並び
+        self.locations: Dict[Tuple[str, float, float], int] = dict()  # (駅名, 緯度, 経度) → 駅コード
+
+        columns = ['index', 'line_cd', 'station_cd', 'line_name', 'line_name_roman',
+                   'station_name', 'station_name_roman', 'lat', 'lon']
+        for row in df.sort_values('index')[columns].itertuples(index=False, name=None):
+            station = Station(
+                int(row[0]), int(row[1]), int(row[2]), row[3], row[4], row[5], row[6], float(row[7]), float(row[8])
+            )
+            self.lines.setdefault(station.line_name, list()).append(station)
+            self.line_romans.setdefault(station.line_name, station.line_name_roman)
+            # 同一路線内で駅名が重複する場合は駅順の若い方を採用(従来の.index.values[0]と同じ)
+            self.stations.setdefault((station.line_name, station.station_name), station)
+            self.locations.setdefault((station.station_name, station.lat, station.lon), station.station_cd)
+        for line, stations in self.lines.items():
+            self.topologies[line] = LineTopology.build(stations)
+
+        self._fuzzy_index = None
+        self._route_graph = None
+        self._nearest_index = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls) -> 'StationIndex':
+        """
+        DBのstation_infoテーブルから索引を作成する
+
+        @return: StationIndex
+        """
+        with psycopg2.connect(**DATABASE) as conn:
+            sql = "select * from station_info;"
+            df = pd.read_sql(sql, conn)
+            version = read_version(conn)
+
+        return cls(df, version)
+
+    @property
+    def fuzzy_index(self) -> FuzzyIndex:
+        """
+        路線名・駅名の「もしかして」候補検索用の索引(初回参照時に作成)
+        """
+        if self._fuzzy_index is None:
+            with self._lock:
+                if self._fuzzy_index is None:
+                    station_romans = {
+                        line: [(s.station_name, s.station_name_roman) for s in stations]
+                        for line, stations in self.lines.items()
+                    }
+                    self._fuzzy_index = FuzzyIndex(self.line_romans, station_romans)
+
+        return self._fuzzy_index
+
+    @property
+    def route_graph(self) -> RouteGraph:
+        """
+        乗換を含む経路探索用の駅グラフ(初回参照時に作成)
+        """
+        if self._route_graph is None:
+            with self._lock:
+                if self._route_graph is None:
+                    self._route_graph = RouteGraph(self.topologies)
+
+        return self._route_graph
+
+    @property
+    def nearest_index(self) -> NearestIndex:
+        """
+        緯度・経度からの最寄り駅検索用の索引(初回参照時に作成)
+        """
+        if self._nearest_index is None:
+            with self._lock:
+                if self._nearest_index is None:
+                    self._nearest_index = NearestIndex(
+                        [station for stations in self.lines.values() for station in stations]
+                    )
+
+        return self._nearest_index
+
+    def has_line(self, line: str) -> bool:
+        """
+        路線名が存在するかを返す
+
+        @param line: 路線名
+        @return: 存在するか否かのbool値
+        """
+        return line in self.lines
+
+    def get_station(self, line: str, station: str) -> Optional[Station]:
+        """
+        (路線名, 駅名)から駅を引く
+
+        @param line: 路線名
+        @param station: 駅名
+        @return: 駅(存在しなければNone)
+        """
+        return self.stations.get((line, station))
+
+    def station_cd_at(self, station: str, lat: float, lon: float) -> Optional[int]:
+        """
+        駅名と位置から駅コードを引く(乗換駅など同じ位置の駅が複数路線にある場合は駅順の若い路線のもの)
+
+        @param station: 駅名
+        @param lat: 緯度
+        @param lon: 経度
+        @return: 駅コード(存在しなければNone)
+        """
+        return self.locations.get((station, lat, lon))
+
+    def stations_on_line(self, line: str) -> List[Station]:
+        """
+        路線内の駅を駅順に返す
+
+        @param line: 路線名
+        @return: 駅リスト
+        """
+        return self.lines.get(line, list())
+
+    def section(self, line: str, start: str, end: str) -> List[Station]:
+        """
+        路線内の乗車駅から降車駅までの区間の駅を乗車駅 → 降車駅順に返す(環状線は短い方の回り方)
+
+        @param line: 路線名
+        @param start: 乗車駅名
+        @param end: 降車駅名
+        @return: 駅リスト
+        """
+        return self.topologies[line].section(start, end)
+
+
+def read_version(conn) -> tuple:
+    """
+    station_infoのバージョン(行数, 全行のハッシュ値)を返す
+
+    @param conn: DBコネクション
+    @return: e.g.) (10840, '3f2a...')
+    """
+    with conn.cursor() as cur:
+        cur.execute(VERSION_SQL)
+        return tuple(cur.fetchone())
+
+
+_station_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_station_index() -> StationIndex:
+    """
+    プロセス内で共有する駅情報索引を返す(初回呼び出し時にDBから作成)
+    STATION_INDEX_CHECK_INTERVAL秒ごとにstation_infoのバージョンを確認し、
+    deploy_station/app.pyで更新されていれば作り直す(作り直す間、他のスレッドは古い索引を使う)
+
+    @return: StationIndex
+    """
+    global _station_index, _checked_at
+    if _station_index is None:
+        with _lock:
+            if _station_index is None:
+                _station_index = StationIndex.from_db()
+                _checked_at = monotonic()
+    elif _station_index.version is not None and monotonic() - _checked_at >= STATION_INDEX_CHECK_INTERVAL:
+        _refresh_if_changed()
+
+    return _station_index
+
+
+def _refresh_if_changed() -> None:
+    """
+    station_infoのバージョンが索引と異なれば索引を作り直す(確認は同時に1スレッドのみ行う)
+    """
+    global _station_index, _checked_at
+    with _lock:
+        if monotonic() - _checked_at < STATION_INDEX_CHECK_INTERVAL:
+            return
+        _checked_at = monotonic()
+        current = _station_index
+
+    try:
+        conn = psycopg2.connect(**DATABASE)
+        try:
+            version = read_version(conn)
+        finally:
+            conn.close()
+        if version == current.version:
+            return
+        station_index = StationIndex.from_db()
+    except psycopg2.Error:
+        # DBに接続できない間は現在の索引を使い続ける
+        return
+
+    with _lock:
+        _station_index = station_index
@@ -2,25 +2,33 @@
 路線、乗車駅、降車駅を受け取り、区間内すべての飲食店情報(ver1はラーメンのみ)を取得して返すクラスを配置するモジュール
 """
 import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
 import psycopg2
-from Levenshtein import distance as levenshtein
+from asgiref.sync import sync_to_async
 
-from . import guruanvi
-from .consts import GURUNAVI_KEY, DATABASE
-from .functions import RomanaizeST
+from . import guruanvi, async_guruanvi
+from .consts import GURUNAVI_KEY, MAX_API_WORKERS, FUZZY_MAX_DISTANCE, QUERY_PLANNING, SHOP_SNAPSHOT_ENABLED
+from .functions import romanaize
+from .station_index import get_station_index
+from .query_plan import RANGE_METERS, plan_queries, assign_stations
+from .distance import distance_matrix
+from .shop_snapshot import load_snapshots
+from .metrics import count, stage, timed
 
-from typing import Tuple
+from typing import Iterator, Optional, Tuple
 
 CATEGORY_DICT = {'ra-men': 'ラーメン', 'cafe': 'カフェ'}
 
 
-class StopoverFood(RomanaizeST):
+class StopoverFood:
     """
     下車飯クラス
     """
-    def __init__(self, line: str, start_station: str, end_station: str, keyword: str, range_: int = 3):
+    def __init__(self, line: str, start_station: str, end_station: str, keyword: str, range_: int = 3,
+                 max_workers: int = MAX_API_WORKERS, use_snapshot: bool = SHOP_SNAPSHOT_ENABLED):
         """
         初期化メソッド
 
@@ -29,14 +37,20 @@ class StopoverFood(RomanaizeST):
         @param end_station: 降車駅 e.g.) '自由が丘'
         @param keyword: 検索キーワード default='ラーメン'
         @param range_: 緯度・経度からの検索範囲(1: 300m, 2: 500m, 3: 1000m, 4: 2000m, 5: 3000m) default=3
+        @param max_workers: ぐるなびAPIへの同時リクエスト数の上限(1のとき逐次実行) default=MAX_API_WORKERS
+        @param use_snapshot: 事前取得した店舗データ(shop_snapshot)を用い、無い駅だけぐるなびAPIに問い合わせるか否か
+            default=SHOP_SNAPSHOT_ENABLED
         """
-        super().__init__()
         self.line = line
         self.start_station = start_station.replace('駅', '')
         self.end_station = end_station.replace('駅', '')
         self.df = None
+        self.station_index = None
         self.api_params = {'key': GURUNAVI_KEY, 'lat': None, 'lng': None,
                            'range': range_, 'keyword': CATEGORY_DICT[keyword], 'station': None}
+        self.category = keyword
+        self.max_workers = max_workers
+        self.use_snapshot = use_snapshot
 
     def _get_station_df(self) -> None:
         """
@@ -45,16 +59,12 @@ class StopoverFood(RomanaizeST):
         """
         self.df = pd.read_csv('./station_data/station.csv', encoding='cp932')
 
-    def _get_station_df_db(self) -> None:
+    @timed('station_load')
+    def _get_station_index(self) -> None:
         """
-        「路線番号」、「駅番号」、「路線名」、「駅名」、「緯度」、「経度」の駅情報データを
-        データフレームとして読み込む(とりあえずCSVファイルから)
+        プロセス内で共有している駅情報索引を取得する(初回のみDBから読み込む)
         """
-        with psycopg2.connect(**DATABASE) as conn:
-            sql = "select * from station_info;"
-            df = pd.read_sql(sql, conn)
-            df.index = df['index']
-        self.df = df
+        self.station_index = get_station_index()
 
     def _validation_line(self) -> Tuple[bool, str]:
         """
@@ -64,9 +74,8 @@ class StopoverFood(RomanaizeST):
         """
         is_validated = True
         message = '合格'
-        line_list = self.df['line_name'].to_list()
 
-        if not(self.line in line_list):
+        if not self.station_index.has_line(self.line):
             return False, f'{self.line}は正しい路線名ではありません、正式名称で入力してください'
 
         return is_validated, message
@@ -77,15 +86,15 @@ class StopoverFood(RomanaizeST):
 
         @return: 追加メッセージ  e.g.) もしかして...〇〇？
         """
-        roman_lines = list(self.df['line_name_roman'].unique())
-        lines = list(self.df['line_name'].unique())
-        partial_matches = [line for line in lines if self.line in line]
+        fuzzy_index = self.station_index.fuzzy_index
+        partial_matches = fuzzy_index.partial_match_lines(self.line)
         if len(partial_matches) > 0:
             return f'。もしかして...{".".join(partial_matches[:3])}?'
-        inputed_line_roman = self.romanaize(self.line)[0]
-        dists = [levenshtein(inputed_line_roman, roman_line) for roman_line in roman_lines]
-        idx = sorted(range(len(dists)), key=lambda x: dists[x])[:3]
-        chance_line = [lines[i] for i in idx]
+        with stage('mecab'):
+            inputed_line_roman = romanaize(self.line)[0]
+        chance_line = fuzzy_index.similar_lines(inputed_line_roman, 3, FUZZY_MAX_DISTANCE)
+        if len(chance_line) == 0:
+            return ''
 
         return f'。もしかして...{",".join(chance_line)}?'
 
@@ -98,12 +107,10 @@ class StopoverFood(RomanaizeST):
         is_validated = True
         message = '合格'
         error_station = ''
-        df = self.df.copy()
         start_and_end = [self.start_station, self.end_station]
-        stations_on_line = df[df['line_name'] == self.line]['station_name'].to_list()
 
         for station in start_and_end:
-            if not (station in stations_on_line):
+            if self.station_index.get_station(self.line, station) is None:
                 return False, f'{station}は{self.line}の駅ではありません', station
 
         return is_validated, message, error_station
@@ -114,89 +121,292 @@ class StopoverFood(RomanaizeST):
 
         @return: 追加メッセージ  e.g.) もしかして...〇〇？
         """
-        roman_stations = self.df[self.df['line_name'] == self.line]['station_name_roman'].to_list()
-        stations = self.df[self.df['line_name'] == self.line]['station_name'].to_list()
-        inputed_station_roman = self.romanaize(station_name)[0]
-        dists = [levenshtein(inputed_station_roman, roman_station) for roman_station in roman_stations]
-        idx = sorted(range(len(dists)), key=lambda x: dists[x])[:3]
-        chance_station = [stations[i] for i in idx]
+        with stage('mecab'):
+            inputed_station_roman = romanaize(station_name)[0]
+        chance_station = self.station_index.fuzzy_index.similar_stations(
+            self.line, inputed_station_roman, 3, FUZZY_MAX_DISTANCE
+        )
+        if len(chance_station) == 0:
+            return ''
 
         return f'。もしかして...{",".join(chance_station)}?'
 
+    @timed('section')
     def _get_section_stations(self) -> list:
         """
         乗車駅と降車駅の区間内の駅の緯度・経度のタプルのリストを返す
 
-        @return: [(緯度, 経度), (緯度, 経度), ..., (緯度, 経度)]
+        @return: [(経度, 緯度, 駅名), (経度, 緯度, 駅名), ..., (経度, 緯度, 駅名)]
         """
-        section = self.df[self.df['line_name'] == self.line]
-        station_nums = (
-            section[section['station_name'] == self.start_station].index.values[0],
-            section[section['station_name'] == self.end_station].index.values[0]
-        )
-        start, end = min(station_nums), max(station_nums)
+        section = self.station_index.section(self.line, self.start_station, self.end_station)
+
+        # 乗車駅 → 降車駅順
+        return [(s.lon, s.lat, s.station_name) for s in section]
+
+    def _plan_queries(self, station_list: list) -> Tuple[list, list]:
+        """
+        ぐるなびAPIへの問い合わせ計画と、問い合わせごとに独立したパラメータ辞書を作成する
+        検索円が大きく重なる隣り合う駅は1回の問い合わせにまとめる(QUERY_PLANNING)
+
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: (問い合わせ計画のリスト, パラメータ辞書のリスト)
+        """
+        range_ = self.api_params['range']
+        clusters = [None] * len(station_list)
+        if QUERY_PLANNING:
+            clusters = self._station_clusters(station_list)
+        plans = plan_queries(station_list, range_, clusters)
+
+        params_list = [
+            dict(self.api_params, lat=plan['lat'], lng=plan['lng'], range=plan['range'],
+                 station=plan['stations'][0][2], merged=plan['merged'])
+            for plan in plans
+        ]
+
+        return plans, params_list
+
+    def _station_lines(self, station_list: list) -> list:
+        """
+        駅ごとの路線名を返す
+
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: 路線名のリスト
+        """
+        return [self.line] * len(station_list)
+
+    def _station_clusters(self, station_list: list) -> list:
+        """
+        駅ごとに、ぐるなびAPIへの問い合わせをまとめる路線内のグループを返す
+        (グループは路線ごとに固定のため、区間が異なる検索でも同じ問い合わせになる)
+
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: (路線名, グループ番号, 中心の緯度, 中心の経度)のリスト(まとめられない駅はNone)
+        """
+        range_ = self.api_params['range']
+        clusters = list()
+        for (_, _, name), line in zip(station_list, self._station_lines(station_list)):
+            cluster = self.station_index.topologies[line].cluster_of(name, range_)
+            clusters.append((line, ) + cluster if cluster is not None else None)
+
+        return clusters
+
+    def _station_params(self, plan: dict) -> list:
+        """
+        まとめた問い合わせ計画の駅ごとのパラメータ辞書を作成する
+
+        @param plan: 問い合わせ計画
+        @return: パラメータ辞書のリスト
+        """
+        return [dict(self.api_params, lat=lat, lng=lon, station=name, merged=False)
+                for lon, lat, name in plan['stations']]
+
+    def _fetch_plan(self, plan: dict, params: dict) -> list:
+        """
+        問い合わせ計画の飲食店情報を取得する
+        まとめた問い合わせの検索結果が1ページに収まらない場合は、駅ごとに問い合わせる
+        (1ページで取得できない店舗を取りこぼさず、駅ごとに問い合わせた場合と同じ店舗にする)
+
+        @param plan: 問い合わせ計画
+        @param params: パラメータ辞書
+        @return: 飲食店情報のリスト(計画の駅順)
+        """
+        if not plan['merged']:
+            return guruanvi.cached_guruanvi_api(params)
+
+        shop_datas = guruanvi.cached_merged_guruanvi_api(params)
+        if shop_datas is not None:
+            return assign_stations(shop_datas, plan, self.api_params['range'])
+
+        count('query_plan_fallbacks')
+        food_list = list()
+        for station_params in self._station_params(plan):
+            food_list.extend(guruanvi.cached_guruanvi_api(station_params))
+
+        return food_list
+
+    async def _fetch_plan_async(self, plan: dict, params: dict) -> list:
+        """
+        _fetch_planの非同期版
+
+        @param plan: 問い合わせ計画
+        @param params: パラメータ辞書
+        @return: 飲食店情報のリスト(計画の駅順)
+        """
+        if not plan['merged']:
+            return await async_guruanvi.cached_guruanvi_api(params)
+
+        shop_datas = await async_guruanvi.cached_merged_guruanvi_api(params)
+        if shop_datas is not None:
+            return assign_stations(shop_datas, plan, self.api_params['range'])
+
+        count('query_plan_fallbacks')
+        results = await asyncio.gather(*[async_guruanvi.cached_guruanvi_api(station_params)
+                                         for station_params in self._station_params(plan)])
+
+        return [food for food_list in results for food in food_list]
+
+    def _split_snapshot(self, station_list: list) -> Tuple[list, list]:
+        """
+        事前取得した店舗データ(shop_snapshot)がある駅の飲食店情報と、無い・古い駅のリストに分ける
+        (テーブルが読めない場合は全駅をぐるなびAPIに問い合わせる)
 
-        # 環状線対策
-        if self.line in ['JR山手線', '大阪環状線']:
-            lon_lat_1 = section.query('@start <= index <= @end')[['lon', 'lat', 'station_name']]
-            lon_lat_2 = section.query('@start >= index or index >= @end')[['lon', 'lat', 'station_name']]
-            lon_lat = lon_lat_1 if (lon_lat_1.shape[0] < lon_lat_2.shape[0]) else lon_lat_2
-        else:
-            lon_lat = section.query('@start <= index <= @end')[['lon', 'lat', 'station_name']]
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: (事前取得した飲食店情報のリスト, ぐるなびAPIに問い合わせる駅のリスト)
+        """
+        station_cds = [self.station_index.station_cd_at(name, lat, lon) for lon, lat, name in station_list]
+        try:
+            with stage('snapshot'):
+                snapshots = load_snapshots([cd for cd in station_cds if cd is not None],
+                                           self.category, self.api_params['range'])
+        except psycopg2.Error:
+            count('shop_snapshot_errors')
+            return list(), station_list
+
+        food_list, missing = list(), list()
+        for station, station_cd in zip(station_list, station_cds):
+            if station_cd in snapshots:
+                food_list.extend(snapshots[station_cd])
+            else:
+                missing.append(station)
+        count('shop_snapshot_hits', len(station_list) - len(missing))
+        count('shop_snapshot_misses', len(missing))
+
+        return food_list, missing
+
+    @staticmethod
+    def _sort_by_station(food_list: list, station_list: list) -> list:
+        """
+        飲食店情報を駅順に並べ替える(同じ駅の中の順番は保つ)
 
-        stations = [tuple(s[1:]) for s in lon_lat.itertuples()]
+        @param food_list: 飲食店情報のリスト
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: 飲食店情報のリスト(station_listの駅順)
+        """
+        positions = dict()
+        for position, (_, _, name) in enumerate(station_list):
+            positions.setdefault(name + '駅', position)
 
-        # 乗車駅 → 降車駅順になるように返す
-        return stations[::-1] if np.argmax(station_nums) == 0 else stations
+        return sorted(food_list, key=lambda food: positions.get(food[12], len(station_list)))
 
+    @timed('gurunavi')
     def _exec_gurunavi_api(self, station_list: list) -> list:
         """
         ぐるなびAPIから緯度・経度をキーに飲食店情報を取得する
-        @param station_list: 駅の(緯度・経度)のリスト
-        @return: 飲食点情報のリスト
+        まとめた問い合わせの結果は各駅に振り分け、最大max_workers件まで並列にリクエストする
+        use_snapshotの場合は事前取得した店舗データが無い・古い駅だけ問い合わせる
+
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: 飲食点情報のリスト(station_listの駅順)
         """
-        food_list = list()
-        for lon, lat, station in station_list:
-            self.api_params['lat'], self.api_params['lng'], self.api_params['station'] = lat, lon, station
-            food_list.extend(guruanvi.guruanvi_api(self.api_params))
+        food_list, live_stations = list(), station_list
+        if self.use_snapshot:
+            food_list, live_stations = self._split_snapshot(station_list)
+
+        plans, params_list = self._plan_queries(live_stations)
+        if len(plans) == 0:
+            return food_list
+
+        with ThreadPoolExecutor(min(self.max_workers, len(params_list))) as e:
+            # mapは入力順に結果を返すため駅順が保たれる
+            for foods in e.map(self._fetch_plan, plans, params_list):
+                food_list.extend(foods)
+
+        if len(live_stations) < len(station_list):
+            return self._sort_by_station(food_list, station_list)
 
         return food_list
 
-    def stopover_food(self) -> tuple:
+    async def _exec_gurunavi_api_async(self, station_list: list) -> list:
         """
-        下車飯クラスのメインメソッド
+        _exec_gurunavi_apiの非同期版
+        スレッドの代わりにイベントループ上でmax_workers件まで同時にリクエストする
 
-        @return:
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: 飲食点情報のリスト(station_listの駅順)
         """
-        food_list = list()
-        food_dict_list = list()
+        food_list, live_stations = list(), station_list
+        if self.use_snapshot:
+            food_list, live_stations = await sync_to_async(self._split_snapshot)(station_list)
+
+        plans, params_list = self._plan_queries(live_stations)
+        if len(plans) == 0:
+            return food_list
+
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def _fetch(plan: dict, params: dict) -> list:
+            async with semaphore:
+                return await self._fetch_plan_async(plan, params)
+
+        # gatherは入力順に結果を返すため駅順が保たれる
+        with stage('gurunavi'):
+            results = await asyncio.gather(*[_fetch(plan, params) for plan, params in zip(plans, params_list)])
+        for foods in results:
+            food_list.extend(foods)
+
+        if len(live_stations) < len(station_list):
+            return self._sort_by_station(food_list, station_list)
+
+        return food_list
+
+    @timed('validation')
+    def _validation(self) -> Tuple[bool, str]:
+        """
+        路線名・駅名のバリデーションを行い、不合格の場合は候補を追加したメッセージを返す
 
+        @return: (合否のbool値, メッセージ)
+        """
         # self._get_station_df()
-        self._get_station_df_db()  # 駅情報のデータフレームを取得
+        self._get_station_index()  # 駅情報の索引を取得
         # 路線名バリデーション
         is_validated, message = self._validation_line()
         if not is_validated:
             plus_message = self._any_chance_line()
-            return food_list, message + plus_message
+            return is_validated, message + plus_message
 
         # 駅名バリデーション
         is_validated, message, error_station = self._validated_station()
         if not is_validated:
             plus_message = self._any_chance_station(error_station)
-            return food_list, message + plus_message
-
-        # 区間内の全駅の緯度・経度のリスト
-        stations = self._get_section_stations()
+            return is_validated, message + plus_message
 
-        # ぐるなびAPIから飲食点情報のリストを取得
-        food_list = self._exec_gurunavi_api(stations)
+        return is_validated, message
 
-        # 店舗が存在しないとき
-        if len(food_list) == 0:
-            return food_dict_list, "指定された条件の店舗が存在しません"
+    @timed('merge')
+    def _merge_foods(self, food_list: list, stations: list) -> list:
+        """
+        飲食店情報のリストを店舗ID(ぐるなびの店舗ID)ごとにまとめ、表示用の辞書に変換する
+        区間内の駅との距離をまとめて計算し、最寄り駅とその距離、検索範囲内の他の駅を近い順に表示する
 
+        @param food_list: ぐるなびAPIから取得した飲食点情報のリスト
+        @param stations: 区間内の駅の(経度, 緯度, 駅名)のリスト
+        @return: 飲食店情報の辞書のリスト(最初に取得された順)
+        """
+        # 同じ店舗は最初に取得した行を代表とする(IDが無い場合はURLで代用)
+        shops = dict()
         for food in food_list:
+            shops.setdefault(food[17] or food[1], food)
+        shops = list(shops.values())
+        if len(shops) == 0:
+            return list()
+
+        # 店舗 × 区間内の駅の距離行列
+        matrix = distance_matrix(
+            [food[15] for food in shops], [food[16] for food in shops],
+            [lat for _, lat, _ in stations], [lon for lon, _, _ in stations]
+        )
+        order = np.argsort(matrix, axis=1, kind='stable')
+        radius = RANGE_METERS[self.api_params['range']]
+
+        food_dict_list = list()
+        for food, dists, idx in zip(shops, matrix, order):
+            # 最寄り駅 + 検索範囲内の他の駅(近い順)
+            nearby = [idx[0]] + [i for i in idx[1:] if dists[i] <= radius]
+            station_texts = [
+                f'{stations[i][2]}駅: {int(dists[i])}m' if dists[i] <= 1000 else f'{stations[i][2]}駅' for i in nearby
+            ]
             food_dict_list.append({
+                "id": food[17],
                 "title": food[0],
                 "pr_text": food[9] if len(food[9]) < 48 else food[9][:48] + '...',
                 "category": food[11],  # e.g.) ラーメン
@@ -204,18 +414,247 @@ class StopoverFood(RomanaizeST):
                 "img": food[10],
                 "address": f'住所: {food[2][9:]}',
                 "tel": f'TEL: {food[3]}',
-                "station": food[12] + ": " + str(int(food[13])) + 'm' if food[13] <= 1000 else food[12],
+                "station": " ".join(station_texts),
+                "distance": float(dists[idx[0]]),  # 最寄り駅からの距離(m)
                 "open_time": f'OPEN: {food[4] if food[4] != food[9] else ""}'  # pr文が入ってることがあるのでその対策
             })
 
-        food_dict = dict()
-        for food in food_dict_list:
-            if food['title'] in food_dict:
-                food_dict[food['title']]['station'] += f" {food['station']}"
+        return food_dict_list
+
+    def stopover_food(self) -> tuple:
+        """
+        下車飯クラスのメインメソッド
+
+        @return: (飲食店情報の辞書のリスト, メッセージ)
+        """
+        food_list = list()
+
+        is_validated, message = self._validation()
+        if not is_validated:
+            return food_list, message
+
+        # 区間内の全駅の緯度・経度のリスト
+        stations = self._get_section_stations()
+
+        # ぐるなびAPIから飲食点情報のリストを取得
+        food_list = self._exec_gurunavi_api(stations)
+
+        # 店舗が存在しないとき
+        if len(food_list) == 0:
+            return list(), "指定された条件の店舗が存在しません"
+
+        return self._merge_foods(food_list, stations), message
+
+    def stopover_food_lazy(self, needed: int, progress: Optional[dict] = None) -> tuple:
+        """
+        乗車駅から降車駅の順に駅をmax_workers駅ずつ検索し、重複削除後の店舗数がneeded以上になった時点で打ち切る
+        progressを渡すと前回打ち切った駅から再開する
+
+        @param needed: 必要な店舗数(表示するページまでの店舗数 + 先読み分)
+        @param progress: 前回の途中経過 e.g.) {'food_list': [...], 'cursor': 4, 'total': 12}
+        @return: (飲食店情報の辞書のリスト, メッセージ, 途中経過)
+        """
+        is_validated, message = self._validation()
+        if not is_validated:
+            return list(), message, None
+
+        stations = self._get_section_stations()
+        if progress is None:
+            progress = {'food_list': list(), 'cursor': 0, 'total': len(stations)}
+        food_list, cursor = list(progress['food_list']), progress['cursor']
+
+        data = self._merge_foods(food_list, stations)
+        while cursor < len(stations) and len(data) < needed:
+            batch = stations[cursor: cursor + self.max_workers]
+            food_list.extend(self._exec_gurunavi_api(batch))
+            cursor += len(batch)
+            data = self._merge_foods(food_list, stations)
+
+        progress = {'food_list': food_list, 'cursor': cursor, 'total': len(stations)}
+
+        # 全駅検索しても店舗が存在しないとき
+        if len(data) == 0:
+            return data, "指定された条件の店舗が存在しません", progress
+
+        return data, message, progress
+
+    async def stopover_food_async(self) -> tuple:
+        """
+        stopover_foodの非同期版(ASGI用)
+        ローマ字変換・駅情報の読み込み・距離計算などのCPU処理はスレッドで行い、イベントループを止めない
+
+        @return: (飲食店情報の辞書のリスト, メッセージ)
+        """
+        # 駅情報の初回読み込みでDBに接続するためthread_sensitiveで実行する
+        is_validated, message = await sync_to_async(self._validation, thread_sensitive=True)()
+        if not is_validated:
+            return list(), message
+
+        stations = self._get_section_stations()
+        food_list = await self._exec_gurunavi_api_async(stations)
+
+        # 店舗が存在しないとき
+        if len(food_list) == 0:
+            return list(), "指定された条件の店舗が存在しません"
+
+        return await sync_to_async(self._merge_foods)(food_list, stations), message
+
+    async def stopover_food_lazy_async(self, needed: int, progress: Optional[dict] = None) -> tuple:
+        """
+        stopover_food_lazyの非同期版(ASGI用)
+
+        @param needed: 必要な店舗数(表示するページまでの店舗数 + 先読み分)
+        @param progress: 前回の途中経過
+        @return: (飲食店情報の辞書のリスト, メッセージ, 途中経過)
+        """
+        is_validated, message = await sync_to_async(self._validation, thread_sensitive=True)()
+        if not is_validated:
+            return list(), message, None
+
+        stations = self._get_section_stations()
+        if progress is None:
+            progress = {'food_list': list(), 'cursor': 0, 'total': len(stations)}
+        food_list, cursor = list(progress['food_list']), progress['cursor']
+
+        merge_foods = sync_to_async(self._merge_foods)
+        data = await merge_foods(food_list, stations)
+        while cursor < len(stations) and len(data) < needed:
+            batch = stations[cursor: cursor + self.max_workers]
+            food_list.extend(await self._exec_gurunavi_api_async(batch))
+            cursor += len(batch)
+            data = await merge_foods(food_list, stations)
+
+        progress = {'food_list': food_list, 'cursor': cursor, 'total': len(stations)}
+
+        # 全駅検索しても店舗が存在しないとき
+        if len(data) == 0:
+            return data, "指定された条件の店舗が存在しません", progress
+
+        return data, message, progress
+
+    def stopover_food_stream(self) -> Iterator[dict]:
+        """
+        区間内の駅の検索が完了するたびに、新たに見つかった飲食店情報を返すジェネレータ
+        最後に件数・エラーをまとめたイベントを返す
+
+        @return: イベント辞書のイテレータ
+            e.g.) {'event': 'shops', 'data': [...], 'stations': ['横浜', '反町'], 'done': 2, 'total': 12}
+                  {'event': 'done', 'count': 35, 'errors': [...], 'message': '合格'}
+        """
+        is_validated, message = self._validation()
+        if not is_validated:
+            yield {'event': 'done', 'count': 0, 'errors': list(), 'message': message}
+            return
+
+        stations = self._get_section_stations()
+        plans, params_list = self._plan_queries(stations)
+        food_list, sent, errors = list(), set(), list()
+        if len(plans) > 0:
+            with ThreadPoolExecutor(min(self.max_workers, len(params_list))) as e:
+                futures = {e.submit(self._fetch_plan, plan, params): plan
+                           for plan, params in zip(plans, params_list)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    plan = futures[future]
+                    station_names = [name for _, _, name in plan['stations']]
+                    try:
+                        food_list.extend(future.result())
+                    except Exception as ex:
+                        errors.append({'stations': station_names, 'error': str(ex)})
+                        continue
+
+                    # 最寄り駅は区間内の全駅との距離で決まるため、送信済みの店舗の表示内容は変わらない
+                    new_shops = [food for food in self._merge_foods(food_list, stations) if food['id'] not in sent]
+                    sent.update(food['id'] for food in new_shops)
+                    yield {'event': 'shops', 'data': new_shops, 'stations': station_names,
+                           'done': done, 'total': len(plans)}
+
+        if len(sent) == 0 and len(errors) == 0:
+            message = "指定された条件の店舗が存在しません"
+        yield {'event': 'done', 'count': len(sent), 'errors': errors, 'message': message}
+
+
+class RouteStopoverFood(StopoverFood):
+    """
+    乗換あり下車飯クラス
+    路線を指定せず、乗車駅から降車駅までの最短経路(乗換を含む)上のすべての駅の飲食店情報を1回の検索で取得する
+    """
+    def __init__(self, start_station: str, end_station: str, keyword: str, range_: int = 3,
+                 max_workers: int = MAX_API_WORKERS, use_snapshot: bool = SHOP_SNAPSHOT_ENABLED):
+        """
+        初期化メソッド
+
+        @param start_station: 乗車駅 e.g.) '横浜'
+        @param end_station: 降車駅 e.g.) '渋谷'
+        @param keyword: 検索キーワード default='ラーメン'
+        @param range_: 緯度・経度からの検索範囲(1: 300m, 2: 500m, 3: 1000m, 4: 2000m, 5: 3000m) default=3
+        @param max_workers: ぐるなびAPIへの同時リクエスト数の上限 default=MAX_API_WORKERS
+        @param use_snapshot: 事前取得した店舗データを用いるか否か default=SHOP_SNAPSHOT_ENABLED
+        """
+        super().__init__('', start_station, end_station, keyword, range_, max_workers, use_snapshot)
+        self.path = None
+
+    @timed('validation')
+    def _validation(self) -> Tuple[bool, str]:
+        """
+        乗車駅・降車駅がいずれかの路線に存在し、経路があるかを確認するメソッド
+
+        @return: (合否のbool値, メッセージ)
+        """
+        self._get_station_index()
+        route_graph = self.station_index.route_graph
+        for station in [self.start_station, self.end_station]:
+            if not route_graph.has_station(station):
+                return False, f'{station}という駅は見つかりません、正式名称で入力してください'
+
+        self.path = route_graph.shortest_path(self.start_station, self.end_station)
+        if self.path is None:
+            return False, f'{self.start_station}から{self.end_station}までの経路が見つかりません'
+
+        return True, '合格'
+
+    @timed('section')
+    def _get_section_stations(self) -> list:
+        """
+        経路上の駅の緯度・経度のタプルのリストを返す(乗換駅は1回だけ含める)
+
+        @return: [(経度, 緯度, 駅名), (経度, 緯度, 駅名), ..., (経度, 緯度, 駅名)]
+        """
+        stations = list()
+        for station in self.path:
+            if stations and stations[-1][2] == station.station_name:
                 continue
-            food_dict[food['title']] = food
+            stations.append((station.lon, station.lat, station.station_name))
+
+        return stations
+
+    def _station_lines(self, station_list: list) -> list:
+        """
+        経路上の駅ごとの路線名を返す(乗換駅は乗換前の路線)
+
+        @param station_list: 駅の(経度, 緯度, 駅名)のリスト
+        @return: 路線名のリスト
+        """
+        lines = dict()
+        for station in self.path:
+            lines.setdefault(station.station_name, station.line_name)
+
+        return [lines[name] for _, _, name in station_list]
+
+
+def make_stopover_food(line: str, start_station: str, end_station: str, keyword: str, **kwargs) -> StopoverFood:
+    """
+    路線名が空の場合は乗換あり下車飯クラス、それ以外は下車飯クラスを返す
+
+    @param line: 路線名(''の場合は経路検索)
+    @param start_station: 乗車駅
+    @param end_station: 降車駅
+    @param keyword: 検索キーワード
+    @return: StopoverFood
+    """
+    if line == '':
+        return RouteStopoverFood(start_station, end_station, keyword, **kwargs)
 
-        return list(food_dict.values()), message
+    return StopoverFood(line, start_station, end_station, keyword, **kwargs)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,188 @@
-from django.test import TestCase
+import math
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from . import station_index
+from .consts import SHOP_CACHE_ALIAS
+from .distance import distances
+from .guruanvi import HIT_PER_PAGE
+from .nearest_index import NearestIndex
+from .query_plan import RANGE_METERS
+from .route_graph import RouteGraph
+from .station_index import LineTopology, Station, StationIndex
+from .stopover_food import StopoverFood
+
+
+def make_line(line_name, points):
+    """
+    (駅名, 緯度, 経度)のリストから駅順の駅リストを作成する
+    """
+    return [
+        Station(order, 1, order, line_name, line_name, station_name, station_name, lat, lon)
+        for order, (station_name, lat, lon) in enumerate(points)
+    ]
+
+
+def ring_points(n):
+    """
+    半径約2kmの円周上に等間隔に並ぶn駅の(駅名, 緯度, 経度)のリストを作成する
+    """
+    return [(f'駅{i}', 35.0 + 0.02 * math.cos(2 * math.pi * i / n), 139.0 + 0.02 * math.sin(2 * math.pi * i / n))
+            for i in range(n)]
+
+
+class LineTopologyTests(SimpleTestCase):
+    def test_linear_line_is_not_loop(self):
+        # 約1km間隔で東へまっすぐ並ぶ路線
+        stations = make_line('直線線', [(f'駅{i}', 35.0, 139.0 + 0.011 * i) for i in range(6)])
+        topology = LineTopology.build(stations)
+
+        self.assertFalse(topology.is_loop)
+        self.assertEqual(len(topology.stations), 6)
+        self.assertEqual([s.station_name for s in topology.section('駅4', '駅1')], ['駅4', '駅3', '駅2', '駅1'])
+
+    def test_branch_line_is_not_loop(self):
+        # 本線(駅0〜駅5)の後に、駅1から北へ分かれる支線(支線1・支線2)を続けて持つ路線
+        # (本線の終点から支線の始点への距離が大きく、支線の終点は始点の近くにある)
+        points = [(f'駅{i}', 35.0, 139.0 + 0.011 * i) for i in range(6)]
+        points += [('支線1', 35.009, 139.011), ('支線2', 35.018, 139.011)]
+        topology = LineTopology.build(make_line('支線線', points))
+
+        self.assertFalse(topology.is_loop)
+        self.assertEqual([s.station_name for s in topology.section('駅1', '駅0')], ['駅1', '駅0'])
+
+    def test_loop_line_with_closing_station(self):
+        # 始点駅を終点にも持つ環状線
+        points = ring_points(8)
+        topology = LineTopology.build(make_line('環状線', points + points[:1]))
+
+        self.assertTrue(topology.is_loop)
+        self.assertEqual(len(topology.stations), 8)
+        self.assertEqual([s.station_name for s in topology.section('駅1', '駅7')], ['駅1', '駅0', '駅7'])
+
+    def test_loop_line_without_closing_station(self):
+        # 始点駅を終点に持たないが、終点の隣が始点に戻る環状線
+        points = ring_points(8)
+        topology = LineTopology.build(make_line('環状線', points))
+
+        self.assertTrue(topology.is_loop)
+        self.assertEqual([s.station_name for s in topology.section('駅6', '駅1')], ['駅6', '駅7', '駅0', '駅1'])
+        self.assertEqual([s.station_name for s in topology.section('駅2', '駅5')], ['駅2', '駅3', '駅4', '駅5'])
+
+
+class RouteGraphTests(SimpleTestCase):
+    def build(self, crossing_lat):
+        # 東西に走る東西線と、南北に走る南北線が「交点」で交わる(南北線の「交点」の緯度はcrossing_lat)
+        east_west = make_line('東西線', [('西2', 35.0, 139.0), ('西1', 35.0, 139.011), ('交点', 35.0, 139.022),
+                                         ('東1', 35.0, 139.033)])
+        north_south = make_line('南北線', [('南1', crossing_lat - 0.009, 139.022), ('交点', crossing_lat, 139.022),
+                                           ('北1', crossing_lat + 0.009, 139.022),
+                                           ('北2', crossing_lat + 0.018, 139.022)])
+        return RouteGraph({'東西線': LineTopology.build(east_west), '南北線': LineTopology.build(north_south)})
+
+    def test_shortest_path_transfers_at_same_station(self):
+        path = self.build(35.0).shortest_path('西1', '北2')
+
+        self.assertEqual([(s.line_name, s.station_name) for s in path],
+                         [('東西線', '西1'), ('東西線', '交点'), ('南北線', '交点'), ('南北線', '北1'), ('南北線', '北2')])
+
+    def test_distant_stations_with_same_name_are_not_transfers(self):
+        # 同じ駅名でもTRANSFER_MAX_DISTANCEより離れた駅は乗換駅とみなさない
+        graph = self.build(35.0 + 0.009 * 2)
+
+        self.assertIsNone(graph.shortest_path('西1', '北2'))
+        self.assertEqual([s.station_name for s in graph.shortest_path('南1', '北2')], ['南1', '交点', '北1', '北2'])
+
+
+class NearestIndexTests(SimpleTestCase):
+    def test_returns_found_stations_when_fewer_than_k(self):
+        # 約1km間隔で東へ並ぶ3駅の路線のみ
+        index = NearestIndex(make_line('短線', [(f'駅{i}', 43.0, 142.0 + 0.012 * i) for i in range(3)]))
+        nearest = index.nearest(43.0, 142.0, 5)
+
+        self.assertEqual([nearby.station_name for nearby in nearest], ['駅0', '駅1', '駅2'])
+        self.assertEqual(nearest[0].lines, ('短線',))
+
+    def test_returns_empty_list_when_no_station_within_max_distance(self):
+        index = NearestIndex(make_line('短線', [(f'駅{i}', 43.0, 142.0 + 0.012 * i) for i in range(3)]))
+
+        self.assertEqual(index.nearest(35.0, 139.0, 5), [])
+
+
+class FakeSearch:
+    """
+    格子状に並ぶ架空の店舗から検索範囲内のものを近い順に返す、guruanvi.searchの代わり
+    """
+    def __init__(self, spacing):
+        """
+        @param spacing: 店舗の間隔(度)
+        """
+        self.calls = list()
+        self.shops = [(35.0 + spacing * i, 139.0 + spacing * j) for i in range(-30, 31) for j in range(-30, 120)]
+
+    def __call__(self, params):
+        self.calls.append(params)
+        lats, lons = zip(*self.shops)
+        dists = distances(params['lat'], params['lng'], lats, lons)
+        hits = sorted((d, n) for n, d in enumerate(dists) if d <= RANGE_METERS[params['range']])
+        shop_datas = [
+            [f'店舗{n}', f'https://r.gnavi.co.jp/{n}/', '〒000-0000 東京都', '', '', '', '', '', '', '', '', 'ラーメン',
+             params['station'] + '駅', float(d), 'ぐるなび', self.shops[n][0], self.shops[n][1], f'id{n}']
+            for d, n in hits[:HIT_PER_PAGE]
+        ]
+        return shop_datas, len(hits)
+
+
+class QueryPlanTests(SimpleTestCase):
+    def setUp(self):
+        # 約700m間隔で東へ並ぶ10駅の路線
+        rows = [(i, 1, 100 + i, '直線線', 'chokusensen', f'東{i}', f'higashi{i}', 35.0, 139.0 + 0.0077 * i)
+                for i in range(10)]
+        df = pd.DataFrame(rows, columns=['index', 'line_cd', 'station_cd', 'line_name', 'line_name_roman',
+                                         'station_name', 'station_name_roman', 'lat', 'lon'])
+        patcher = mock.patch.object(station_index, '_station_index', StationIndex(df))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        caches[SHOP_CACHE_ALIAS].clear()
+        self.addCleanup(caches[SHOP_CACHE_ALIAS].clear)
+
+    def search(self, fake, planning, start='東0', end='東9'):
+        caches[SHOP_CACHE_ALIAS].clear()
+        fake.calls.clear()
+        with mock.patch('stopover_food_app.guruanvi.search', fake), \
+                mock.patch('stopover_food_app.stopover_food.QUERY_PLANNING', planning):
+            data, _ = StopoverFood('直線線', start, end, 'ra-men', use_snapshot=False).stopover_food()
+        return {(food['id'], food['station']) for food in data}, len(fake.calls)
+
+    def test_planned_search_returns_same_shops_with_fewer_calls(self):
+        # 検索円が1ページに収まる密度
+        fake = FakeSearch(0.008)
+        unplanned, unplanned_calls = self.search(fake, False)
+        planned, planned_calls = self.search(fake, True)
+
+        self.assertTrue(len(unplanned) > 0)
+        self.assertEqual(planned, unplanned)
+        self.assertEqual(unplanned_calls, 10)
+        self.assertLess(planned_calls, unplanned_calls)
+
+    def test_dense_area_falls_back_to_each_station(self):
+        # まとめた検索円が1ページに収まらない密度
+        fake = FakeSearch(0.0006)
+        unplanned, _ = self.search(fake, False)
+        planned, _ = self.search(fake, True)
+
+        self.assertEqual(planned, unplanned)
+        self.assertTrue(any(params['merged'] for params in fake.calls))
+
+    def test_merged_queries_do_not_depend_on_section(self):
+        fake = FakeSearch(0.008)
+        self.search(fake, True, '東0', '東9')
+        full = {(params['lat'], params['lng'], params['range']) for params in fake.calls}
+        self.search(fake, True, '東1', '東8')
+        part = {(params['lat'], params['lng'], params['range']) for params in fake.calls if params['merged']}
+
+        self.assertTrue(part)
+        self.assertLessEqual(part, full)
@@ -4,4 +4,9 @@ from . import views
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('stream/', views.stream, name='stream'),
+    path('async/', views.index_async, name='index_async'),
+    path('api/search', views.search_api, name='search_api'),
+    path('api/nearest', views.nearest_api, name='nearest_api'),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -2,12 +2,121 @@
 サイト側との橋渡し的スクリプト
 """
 import sys
+import math
+import json
+import hashlib
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import parse_etags
 from django.template import loader
+from asgiref.sync import sync_to_async
 
-from .stopover_food import StopoverFood
+from .stopover_food import StopoverFood, make_stopover_food
+from .station_index import get_station_index
 from .guruanvi import get_img
+from . import async_guruanvi
+from .metrics import stage, export_text
+from .snapshot import save_snapshot, load_snapshot, is_complete, digest
+from .singleflight import get_single_flight
+from .consts import PAGE_NUM, LAZY_FETCH, LAZY_LOOKAHEAD, NEAREST_K, NEAREST_MAX_K
+
+from typing import Iterator, Optional, Tuple
+
+
+def estimate_pagecount(data_num: int, progress: Optional[dict], page_num: int = PAGE_NUM) -> Tuple[int, bool]:
+    """
+    ページ数を返す
+    途中までしか検索していない場合は、検索済みの駅あたりの店舗数から区間全体のページ数を推定する
+
+    @param data_num: 取得済みの店舗数
+    @param progress: 途中経過(StopoverFood.stopover_food_lazy参照)
+    @param page_num: 1ページあたりの表示件数
+    @return: (ページ数, 推定値か否かのbool値)
+    """
+    pagecount = math.ceil(data_num / page_num)
+    if is_complete(progress):
+        return pagecount, False
+
+    estimated = math.ceil(data_num / progress['cursor'] * progress['total'] / page_num)
+
+    return max(estimated, pagecount), True
+
+
+def _search(query: tuple, page: int, token: str) -> Tuple[list, Optional[dict], Optional[str], str, str]:
+    """
+    スナップショットに表示するページまでの検索結果があればそれを返し、無ければ検索してスナップショットに保存する
+    スナップショットが無い検索は、同じ条件の検索が実行中であればその結果(スナップショット)を共有する
+
+    @param query: 検索条件 e.g.) ('東急東横線', '横浜', '自由が丘', 'ra-men')
+    @param page: 表示するページ(0始まり)
+    @param token: スナップショットキー
+    @return: (飲食店情報の辞書のリスト, 途中経過, スナップショットキー, 検索結果のハッシュ値, メッセージ)
+    """
+    snapshot = load_snapshot(token, query)
+    needed = (page + 1) * PAGE_NUM + LAZY_LOOKAHEAD
+    if snapshot is None:
+        return get_single_flight('search').do((query, needed), _run_search, query, needed)
+
+    data, progress, etag = snapshot['data'], snapshot['progress'], snapshot['etag']
+    if not is_complete(progress) and len(data) < needed:
+        return _run_search(query, needed, progress, token)
+
+    return data, progress, token, etag, ''
+
+
+def _run_search(query: tuple, needed: int, progress: Optional[dict] = None,
+                token: Optional[str] = None) -> Tuple[list, Optional[dict], Optional[str], str, str]:
+    """
+    飲食店情報を検索してスナップショットに保存する(progressを渡すと前回の続きから検索する)
+
+    @param query: 検索条件
+    @param needed: 必要な店舗数
+    @param progress: 前回の途中経過
+    @param token: スナップショットキー
+    @return: (飲食店情報の辞書のリスト, 途中経過, スナップショットキー, 検索結果のハッシュ値, メッセージ)
+    """
+    # 飲食店情報取得
+    sf = make_stopover_food(*query)
+    if LAZY_FETCH:
+        # 表示するページに必要な分の駅だけ検索(前回の続きから)
+        data, message, progress = sf.stopover_food_lazy(needed, progress)
+    else:
+        data, message = sf.stopover_food()
+
+    if len(data) == 0:
+        return data, progress, token, '', message
+
+    etag = digest(data)
+    token = save_snapshot(query, data, progress, token, etag)
+
+    return data, progress, token, etag, message
+
+
+async def _run_search_async(query: tuple, needed: int, progress: Optional[dict] = None,
+                            token: Optional[str] = None) -> Tuple[list, Optional[dict], Optional[str], str, str]:
+    """
+    _run_searchの非同期版
+
+    @param query: 検索条件
+    @param needed: 必要な店舗数
+    @param progress: 前回の途中経過
+    @param token: スナップショットキー
+    @return: (飲食店情報の辞書のリスト, 途中経過, スナップショットキー, 検索結果のハッシュ値, メッセージ)
+    """
+    sf = make_stopover_food(*query)
+    if LAZY_FETCH:
+        data, message, progress = await sf.stopover_food_lazy_async(needed, progress)
+    else:
+        data, message = await sf.stopover_food_async()
+
+    if len(data) == 0:
+        return data, progress, token, '', message
+
+    # スナップショットのキャッシュはファイル・memcached等の場合があるためスレッドで読み書きする
+    etag = await sync_to_async(digest)(data)
+    token = await sync_to_async(save_snapshot)(query, data, progress, token, etag)
+
+    return data, progress, token, etag, message
 
 
 def index(request):
@@ -23,42 +132,233 @@ def index(request):
     context = {
         "data": list(),
         "pagecount": 0,
-        "message": ""
+        "pagecount_estimated": False,
+        "message": "",
+        "snapshot": ""
     }
     # GET.__contains__('key): 指定のキーが設定されている場合にTrueを返す
     # line: 路線, start: 乗車駅, end: 降車駅, category: カテゴリーに対応する
     if (request.GET.__contains__('line') and request.GET.__contains__('start') and
             request.GET.__contains__('end') and request.GET.__contains__('category')):
 
-        # 飲食店情報取得
-        sf = StopoverFood(request.GET['line'], request.GET['start'], request.GET['end'], request.GET['category'])
-        data, message = sf.stopover_food()
+        query = (request.GET['line'], request.GET['start'], request.GET['end'], request.GET['category'])
+
+        # 2ページ目以降に遷移する場合
+        page = 0
+        if request.GET.__contains__('page'):
+            page = max(int(request.GET['page']) - 1, 0)
+
+        # 2ページ目以降はスナップショットから取得(期限切れの場合は再計算)
+        with stage('search'):
+            data, progress, token, _, message = _search(query, page, request.GET.get('snapshot', ''))
 
         # 飲食店情報が取得できなかった場合エラーメッセージ送信
         if len(data) == 0:
             context["message"] = message
-            return HttpResponse(template.render(context, request))
+            with stage('render'):
+                return HttpResponse(template.render(context, request))
+        context["snapshot"] = token
 
         # ページ数
-        page_num = 15
-        pagecount = int(len(data) / page_num)
-        if len(data) / page_num - pagecount > 0:
-            pagecount += 1
+        pagecount, pagecount_estimated = estimate_pagecount(len(data), progress)
 
-        # 2ページ目以降に遷移する場合
+        data = data[page * PAGE_NUM: page * PAGE_NUM + PAGE_NUM]
+
+        with stage('images'):
+            data = get_img(data)
+        context["data"] = data
+        context["pagecount"] = pagecount
+        context["pagecount_estimated"] = pagecount_estimated
+
+    with stage('render'):
+        return HttpResponse(template.render(context, request))
+
+
+def search_api(request):
+    """
+    requestから路線、乗車駅、降車駅、カテゴリー、ページを取得し、飲食店情報をJSONで返す
+    ETagは検索結果(スナップショット保存時に計算したハッシュ値)とページから求め、
+    If-None-Matchが一致する場合はJSONを作らずに304を返す
+    (画像のスクレイピングは行わない。スナップショットキーはX-Snapshotヘッダで返す)
+
+    @param request: requests
+    @return: JsonResponse
+    """
+    if not (request.GET.__contains__('line') and request.GET.__contains__('start') and
+            request.GET.__contains__('end') and request.GET.__contains__('category')):
+        return HttpResponseBadRequest('line, start, end, categoryを指定してください')
+
+    query = (request.GET['line'], request.GET['start'], request.GET['end'], request.GET['category'])
+    try:
+        page = max(int(request.GET.get('page', 1)) - 1, 0)
+    except ValueError:
+        return HttpResponseBadRequest('pageは整数で指定してください')
+
+    with stage('search'):
+        data, progress, token, etag, message = _search(query, page, request.GET.get('snapshot', ''))
+    if len(data) == 0:
+        return JsonResponse({'message': message, 'count': 0, 'page': page + 1, 'pagecount': 0,
+                             'pagecount_estimated': False, 'shops': list()}, json_dumps_params={'ensure_ascii': False})
+
+    pagecount, pagecount_estimated = estimate_pagecount(len(data), progress)
+    page_etag = '"{}"'.format(hashlib.sha1(
+        f'{etag}:{page}:{len(data)}:{pagecount}:{pagecount_estimated}'.encode('utf-8')
+    ).hexdigest())
+
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if page_etag in if_none_match or '*' in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({
+            'message': '',
+            'count': len(data),
+            'page': page + 1,
+            'pagecount': pagecount,
+            'pagecount_estimated': pagecount_estimated,
+            'shops': data[page * PAGE_NUM: page * PAGE_NUM + PAGE_NUM]
+        }, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+    response['ETag'] = page_etag
+    response['Cache-Control'] = 'no-cache'  # 保存は許可し、利用前に毎回ETagで再検証させる
+    response['X-Snapshot'] = token
+
+    return response
+
+
+async def index_async(request):
+    """
+    indexの非同期版(ASGIで起動した場合に、ぐるなびAPI・画像取得の待ち時間中にワーカーを占有しない)
+    スナップショット・遅延取得の挙動はindexと同じ
+
+    @param request: requests
+    @return: HttpResponse
+    """
+    template = loader.get_template('stopover_food_app/index.html')
+    context = {
+        "data": list(),
+        "pagecount": 0,
+        "pagecount_estimated": False,
+        "message": "",
+        "snapshot": ""
+    }
+    if (request.GET.__contains__('line') and request.GET.__contains__('start') and
+            request.GET.__contains__('end') and request.GET.__contains__('category')):
+
+        query = (request.GET['line'], request.GET['start'], request.GET['end'], request.GET['category'])
+
+        page = 0
         if request.GET.__contains__('page'):
-            page = int(request.GET['page']) - 1
-            if page < 0:
-                page = 0
+            page = max(int(request.GET['page']) - 1, 0)
 
-            data = data[page * page_num: page * page_num + page_num]
+        with stage('search'):
+            # スナップショットのキャッシュはファイル・memcached等の場合があるためスレッドで読み書きする
+            token = request.GET.get('snapshot', '')
+            snapshot = await sync_to_async(load_snapshot)(token, query)
 
-        # 1ページ目
-        else:
-            data = data[0: page_num]
+            needed = (page + 1) * PAGE_NUM + LAZY_LOOKAHEAD
+            message = ''
+            if snapshot is None:
+                data, progress, token, _, message = await get_single_flight('search').do_async(
+                    (query, needed), _run_search_async, query, needed
+                )
+            else:
+                data, progress = snapshot['data'], snapshot['progress']
+                if not is_complete(progress) and len(data) < needed:
+                    data, progress, token, _, message = await _run_search_async(query, needed, progress, token)
 
-        data = get_img(data)
+        if len(data) == 0:
+            context["message"] = message
+            with stage('render'):
+                return HttpResponse(await sync_to_async(template.render)(context, request))
+        context["snapshot"] = token
+
+        pagecount, pagecount_estimated = estimate_pagecount(len(data), progress)
+
+        data = data[page * PAGE_NUM: page * PAGE_NUM + PAGE_NUM]
+
+        with stage('images'):
+            data = await async_guruanvi.get_img(data)
         context["data"] = data
         context["pagecount"] = pagecount
+        context["pagecount_estimated"] = pagecount_estimated
+
+    with stage('render'):
+        return HttpResponse(await sync_to_async(template.render)(context, request))
+
+
+def _sse_events(sf: StopoverFood) -> Iterator[str]:
+    """
+    下車飯クラスの検索結果をServer-Sent Events形式の文字列にして返すジェネレータ
+    画像のスクレイピングは最初に送るPAGE_NUM件(検索ページの1ページ目に相当)だけ行い、以降はAPIの画像URLのまま送る
+
+    @param sf: 下車飯クラス
+    @return: SSEのイベント文字列のイテレータ
+    """
+    sent = 0
+    for event in sf.stopover_food_stream():
+        name = event.pop('event')
+        if name == 'shops':
+            scraped = max(PAGE_NUM - sent, 0)
+            sent += len(event['data'])
+            if scraped > 0:
+                event['data'] = get_img(event['data'][:scraped]) + event['data'][scraped:]
+        yield f'event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'
+
+
+def stream(request):
+    """
+    requestから路線、乗車駅、降車駅、カテゴリーを取得し、駅の検索が完了するたびに飲食店情報を送信する(Server-Sent Events)
+    event: shops → 新たに見つかった飲食店情報, event: done → 件数・エラー・メッセージ
+    (検索ページからは使わず、EventSource等で受け取るクライアント向けのAPI)
+
+    @param request: requests
+    @return: StreamingHttpResponse
+    """
+    if not (request.GET.__contains__('line') and request.GET.__contains__('start') and
+            request.GET.__contains__('end') and request.GET.__contains__('category')):
+        return HttpResponseBadRequest('line, start, end, categoryを指定してください')
+
+    sf = make_stopover_food(request.GET['line'], request.GET['start'], request.GET['end'], request.GET['category'])
+    response = StreamingHttpResponse(_sse_events(sf), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx等のプロキシでバッファリングさせない
+
+    return response
+
 
-    return HttpResponse(template.render(context, request))
+def nearest_api(request):
+    """
+    requestから緯度・経度を取得し、近い順にk駅(駅名・路線名・距離)をJSONで返す
+    e.g.) /api/nearest?lat=35.681&lon=139.767&k=5
+        → {"stations": [{"station": "東京", "lines": ["JR山手線", ...], "distance": 120, "lat": ..., "lon": ...}, ...]}
+
+    @param request: requests
+    @return: JsonResponse
+    """
+    try:
+        lat, lon = float(request.GET['lat']), float(request.GET['lon'])
+        k = int(request.GET.get('k', NEAREST_K))
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('lat, lonを数値で指定してください(kは整数)')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return HttpResponseBadRequest('lat, lonの範囲が正しくありません')
+    if not 1 <= k <= NEAREST_MAX_K:
+        return HttpResponseBadRequest(f'kは1〜{NEAREST_MAX_K}で指定してください')
+
+    with stage('nearest'):
+        stations = get_station_index().nearest_index.nearest(lat, lon, k)
+
+    return JsonResponse({'stations': [
+        {'station': s.station_name, 'lines': list(s.lines), 'distance': round(s.distance), 'lat': s.lat, 'lon': s.lon}
+        for s in stations
+    ]}, json_dumps_params={'ensure_ascii': False})
+
+
+def metrics(request):
+    """
+    累積カウンタ(ぐるなびAPIへのリクエスト・リトライ・404、キャッシュのヒット)と
+    ステージごとの処理時間の分位点(p50/p95/p99)をテキスト形式で返す
+
+    @param request: requests
+    @return: HttpResponse
+    """
+    return HttpResponse(export_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
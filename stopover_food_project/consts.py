@@ -7,6 +7,28 @@ env.read_env('.env')
 KEY = env('KEY')
 HOST = env('HOST')
 
+# ぐるなびAPIの店舗データキャッシュのバックエンド(ワーカー間で共有する場合はファイル・memcached等を指定)
+GURUNAVI_CACHE = {
+    "backend": env('GURUNAVI_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+    "location": env('GURUNAVI_CACHE_LOCATION', default='gurunavi'),
+    "max_entries": int(env('SHOP_CACHE_MAX_ENTRIES', default=5000)),
+}
+
+# 店舗url → 画像urlの対応を保存するキャッシュ(再起動後も残るようデフォルトはファイル)
+# ファイルの場合は保存のたびにディレクトリ内の全ファイルを数えるため件数上限を小さくする(本番はmemcached・redis等を推奨)
+SHOP_IMAGE_CACHE = {
+    "backend": env('SHOP_IMAGE_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+    "location": env('SHOP_IMAGE_CACHE_LOCATION', default='/var/tmp/stopover_food/shop_image'),
+    "max_entries": int(env('SHOP_IMAGE_CACHE_MAX_ENTRIES', default=5000)),
+}
+
+# ページ送り用の検索結果スナップショットを保存するキャッシュ
+# (2ページ目以降のリクエストは別のワーカーに届くため、複数ワーカーではファイル・memcached等の共有バックエンドを指定する)
+SNAPSHOT_CACHE = {
+    "backend": env('SNAPSHOT_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+    "location": env('SNAPSHOT_CACHE_LOCATION', default='snapshot'),
+}
+
 DATABASE = {
     "dbname": env('DBNAME'),
     "host": env('DB_HOST'),
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 from pathlib import Path
 
-from .consts import KEY, HOST, DATABASE
+from .consts import KEY, HOST, DATABASE, GURUNAVI_CACHE, SHOP_IMAGE_CACHE, SNAPSHOT_CACHE
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'stopover_food_app.middleware.ServerTimingMiddleware',  # 最外側に置き、リクエスト全体の処理時間も計測する
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +87,36 @@ DATABASES = {
    }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # ぐるなびAPIの店舗データ(件数上限はバックエンドのMAX_ENTRIESで管理)
+    'gurunavi': {
+        'BACKEND': GURUNAVI_CACHE['backend'],
+        'LOCATION': GURUNAVI_CACHE['location'],
+        'OPTIONS': {
+            'MAX_ENTRIES': GURUNAVI_CACHE['max_entries'],
+        },
+    },
+    # 店舗url → 画像urlの対応
+    'shop_image': {
+        'BACKEND': SHOP_IMAGE_CACHE['backend'],
+        'LOCATION': SHOP_IMAGE_CACHE['location'],
+        'OPTIONS': {
+            'MAX_ENTRIES': SHOP_IMAGE_CACHE['max_entries'],
+        },
+    },
+    # ページ送り用の検索結果スナップショット(ワーカー間で共有する)
+    'snapshot': {
+        'BACKEND': SNAPSHOT_CACHE['backend'],
+        'LOCATION': SNAPSHOT_CACHE['location'],
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 